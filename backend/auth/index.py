@@ -1,135 +1,120 @@
-import json
-import os
-import hashlib
-import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: User registration and login
-    Args: event with httpMethod, body
-    Returns: HTTP response with user data or error
-    '''
-    method: str = event.get('httpMethod', 'GET')
+from psycopg2 import errors
+
+import db
+import passwords
+import runtime
+import session
+import tracing
+from phone import normalize_phone
+
+USER_KEYS = ('id', 'username', 'display_name', 'avatar', 'status', 'phone')
+
+# Inserts the user and links contacts waiting for this phone in one statement; duplicates
+# are caught by the unique indexes (db_migrations/V0014) rather than checked beforehand
+REGISTER_SQL = """
+    WITH new_user AS (
+        INSERT INTO users (username, password_hash, display_name, avatar, phone)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id, username, display_name, avatar, status, phone
+    ), linked AS (
+        UPDATE contacts SET contact_user_id = new_user.id
+        FROM new_user
+        WHERE contacts.contact_phone = new_user.phone AND contacts.contact_user_id IS NULL
+    )
+    SELECT id, username, display_name, avatar, status, phone FROM new_user
+"""
+CONFLICT_ERRORS = {
+    'users_username_key': 'Username already exists',
+    'idx_users_phone_normalized': 'Phone number already registered',
+}
+
+def credentials(request: runtime.Request) -> Optional[Tuple[str, str]]:
+    '''(username, password) from the body, or None when either is missing'''
+    username = request.body.get('username', '').strip()
+    password = request.body.get('password', '').strip()
+    if not username or not password:
+        return None
+    return username, password
+
+def signed_in(user: Tuple) -> runtime.Response:
+    '''User data plus a session token (None while sessions are disabled)'''
+    return runtime.ok({'user': dict(zip(USER_KEYS, user)), 'token': session.issue(user[0])})
+
+def register(request: runtime.Request) -> runtime.Response:
+    creds = credentials(request)
+    if not creds:
+        return runtime.error(400, 'Username and password required')
+    username, password = creds
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+    display_name = request.body.get('display_name', username)
+    avatar = request.body.get('avatar', '👤')
+    raw_phone = request.body.get('phone', '').strip()
     
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+    if not raw_phone:
+        return runtime.error(400, 'Phone number required')
     
-    body_data = json.loads(event.get('body', '{}'))
-    action = body_data.get('action')
-    username = body_data.get('username', '').strip()
-    password = body_data.get('password', '').strip()
+    phone = normalize_phone(raw_phone)
+    if not phone:
+        return runtime.error(400, 'Invalid phone number')
     
-    if not username or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Username and password required'})
-        }
+    password_hash = passwords.hash_password(password)
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(REGISTER_SQL, (username, password_hash, display_name, avatar, phone))
+                user = cur.fetchone()
+    except errors.UniqueViolation as e:
+        message = CONFLICT_ERRORS.get(e.diag.constraint_name)
+        if message is None:
+            raise
+        return runtime.error(400, message)
     
-    dsn = os.environ.get('DATABASE_URL')
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    return signed_in(user)
+
+def login(request: runtime.Request) -> runtime.Response:
+    creds = credentials(request)
+    if not creds:
+        return runtime.error(400, 'Username and password required')
     
-    with psycopg2.connect(dsn) as conn:
+    username, password = creds
+    
+    with db.connection() as conn:
         with conn.cursor() as cur:
-            if action == 'register':
-                display_name = body_data.get('display_name', username)
-                avatar = body_data.get('avatar', '👤')
-                phone = body_data.get('phone', '').strip()
-                
-                if not phone:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Phone number required'})
-                    }
-                
-                cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-                if cur.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Username already exists'})
-                    }
-                
-                cur.execute("SELECT id FROM users WHERE phone = %s", (phone,))
-                if cur.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Phone number already registered'})
-                    }
-                
-                cur.execute(
-                    "INSERT INTO users (username, password_hash, display_name, avatar, phone) VALUES (%s, %s, %s, %s, %s) RETURNING id, username, display_name, avatar, status, phone",
-                    (username, password_hash, display_name, avatar, phone)
-                )
-                user = cur.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': {
-                            'id': user[0],
-                            'username': user[1],
-                            'display_name': user[2],
-                            'avatar': user[3],
-                            'status': user[4],
-                            'phone': user[5]
-                        }
-                    })
-                }
-            
-            elif action == 'login':
+            cur.execute(
+                "SELECT id, username, display_name, avatar, status, phone, password_hash FROM users WHERE username = %s",
+                (username,)
+            )
+            user = cur.fetchone()
+    
+    # Hashed with no connection held, so the pool does not cap logins; unknown
+    # usernames pay for a full hash as well
+    matches, needs_rehash = passwords.verify_password(password, user[6] if user else passwords.DUMMY_HASH)
+    if not user or not matches:
+        return runtime.error(401, 'Invalid credentials')
+    if needs_rehash:
+        password_hash = passwords.hash_password(password)
+        # Unless the password changed in the meantime
+        with db.connection() as conn:
+            with conn.cursor() as cur:
                 cur.execute(
-                    "SELECT id, username, display_name, avatar, status, phone FROM users WHERE username = %s AND password_hash = %s",
-                    (username, password_hash)
+                    "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (password_hash, user[0], user[6])
                 )
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Invalid credentials'})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': {
-                            'id': user[0],
-                            'username': user[1],
-                            'display_name': user[2],
-                            'avatar': user[3],
-                            'status': user[4],
-                            'phone': user[5]
-                        }
-                    })
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid action'})
-                }
\ No newline at end of file
+    
+    return signed_in(user)
+
+router = runtime.Router({
+    ('POST', 'register'): register,
+    ('POST', 'login'): login,
+})
+
+@tracing.traced('auth')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: User registration and login
+    Args: event with httpMethod, body
+    Returns: HTTP response with user data and session token, or error
+    '''
+    return router.dispatch(event)
\ No newline at end of file
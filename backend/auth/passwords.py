@@ -0,0 +1,53 @@
+import base64
+import hashlib
+import hmac
+import os
+from typing import Tuple
+
+# Password storage: "pbkdf2_sha256$<iterations>$<salt>$<hash>" with a random
+# 16-byte salt. PASSWORD_ITERATIONS is the work factor; it bounds login
+# throughput, see backend/tools/bench_auth.py. Hashes with another work
+# factor, and unsalted SHA-256 hex digests from before, still verify and
+# are rehashed by login.
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', '260000'))
+SALT_BYTES = 16
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def hash_password(password: str, iterations: int = ITERATIONS) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    '''(matches, needs_rehash) for a password against a stored hash'''
+    if stored.startswith(ALGORITHM + '$'):
+        try:
+            _, iterations, salt, expected = stored.split('$')
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), _unb64(salt), int(iterations))
+            matches = hmac.compare_digest(digest, _unb64(expected))
+        except ValueError:
+            return False, False
+        return matches, matches and int(iterations) != ITERATIONS
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    if not hmac.compare_digest(legacy, stored):
+        # A miss must cost a full hash here too, or timing tells which
+        # usernames exist among accounts that still carry a legacy hash
+        verify_password(password, DUMMY_HASH)
+        return False, False
+    return True, True
+
+
+# Verified against when the username does not exist, so that a miss costs as
+# much as a wrong password (built without hashing to keep imports cheap)
+DUMMY_HASH = f'{ALGORITHM}${ITERATIONS}${_b64(bytes(SALT_BYTES))}${_b64(bytes(32))}'
@@ -0,0 +1,20 @@
+import re
+
+# Shipped with both auth and users; keep in sync with the normalize_phone()
+# SQL function from db_migrations/V0009.
+
+
+def normalize_phone(raw: str) -> str:
+    '''
+    Brings a phone number to "+<digits>". Russian 8XXXXXXXXXX and 10-digit
+    local numbers become +7XXXXXXXXXX. Returns '' for anything that is not
+    5 to 15 digits long.
+    '''
+    digits = re.sub(r'\D', '', raw or '')
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    if not 5 <= len(digits) <= 15:
+        return ''
+    return '+' + digits
@@ -0,0 +1,172 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import session
+import tracing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Request routing and response building shared by the handlers. The same file
+# is shipped with every function (auth, users, messages).
+#
+# Responses go through dumps(): orjson when it is installed (it encodes
+# datetimes itself, so rows can be passed straight from the cursor), the
+# standard json module otherwise.
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+ALLOW_HEADERS = 'Content-Type, X-Session-Token, X-User-Id'
+PREFLIGHT_MAX_AGE = '86400'
+
+Response = Dict[str, Any]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj: Any) -> str:
+    with tracing.phase('serialize'):
+        if orjson is not None:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def join_json(items: Iterable[Any], separator: bytes) -> bytes:
+    '''Encodes a batch of values and joins them, e.g. with b'\\n' for NDJSON'''
+    with tracing.phase('serialize'):
+        return separator.join(dumps_bytes(item) for item in items)
+
+
+def loads(data: Any) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def rows_to_dicts(keys: Sequence[str], rows: Iterable[Tuple]) -> List[Dict[str, Any]]:
+    '''Cursor tuples as dicts keyed by column; extra trailing columns are dropped'''
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def respond(status: int, payload: Any) -> Response:
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dumps(payload)}
+
+
+def ok(payload: Any) -> Response:
+    return respond(200, payload)
+
+
+def error(status: int, message: str) -> Response:
+    return respond(status, {'error': message})
+
+
+def binary(status: int, data: Union[bytes, bytearray], headers: Dict[str, str]) -> Response:
+    '''Response with a binary body, base64-encoded as the function gateway expects'''
+    return {
+        'statusCode': status,
+        'headers': dict(headers, **{'Access-Control-Allow-Origin': '*'}),
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def preflight(methods: str) -> Response:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': ALLOW_HEADERS,
+            'Access-Control-Max-Age': PREFLIGHT_MAX_AGE
+        },
+        'body': ''
+    }
+
+
+_UNSET = object()
+
+
+class Request:
+    '''
+    Accessors over the cloud function event; the body is parsed and the caller
+    authenticated once, on first use
+    '''
+
+    __slots__ = ('event', 'method', 'headers', 'query', '_body', '_user_id')
+
+    def __init__(self, event: Dict[str, Any]):
+        self.event = event
+        self.method: str = event.get('httpMethod', 'GET')
+        self.headers: Dict[str, str] = event.get('headers') or {}
+        self.query: Dict[str, str] = event.get('queryStringParameters') or {}
+        self._body: Optional[Dict[str, Any]] = None
+        self._user_id: Any = _UNSET
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        if self._body is None:
+            self._body = loads(self.event.get('body') or '{}')
+        return self._body
+
+    def header(self, name: str) -> Optional[str]:
+        return self.headers.get(name) or self.headers.get(name.lower())
+
+    @property
+    def user_id(self) -> Optional[int]:
+        '''
+        Caller from the X-Session-Token header; the bare X-User-Id header is
+        only trusted when sessions are disabled and TRUST_USER_ID_HEADER=1
+        '''
+        if self._user_id is _UNSET:
+            if session.enabled():
+                self._user_id = session.verify(self.header('X-Session-Token') or '')
+            elif session.TRUST_USER_ID_HEADER:
+                value = self.header('X-User-Id')
+                self._user_id = int(value) if value else None
+            else:
+                self._user_id = None
+        return self._user_id
+
+
+Route = Callable[[Request], Response]
+
+
+class Router:
+    '''
+    Routing table of a handler, keyed by (method, action). POST routes with an
+    action match body['action']; (method, None) matches everything else.
+    '''
+
+    def __init__(self, routes: Dict[Tuple[str, Optional[str]], Route],
+                 unauthorized: Optional[str] = None):
+        self.routes = routes
+        self.unauthorized = unauthorized
+        self.actions = {method for method, action in routes if action is not None}
+        methods = sorted({method for method, _ in routes}) + ['OPTIONS']
+        self.preflight = preflight(', '.join(methods))
+
+    def dispatch(self, event: Dict[str, Any]) -> Response:
+        request = Request(event)
+        method = request.method
+        if method == 'OPTIONS':
+            return self.preflight
+        if self.unauthorized and request.user_id is None:
+            return error(401, self.unauthorized)
+        action = request.body.get('action') if method in self.actions else None
+        route = self.routes.get((method, action)) or self.routes.get((method, None))
+        if route is not None:
+            return route(request)
+        if method in self.actions:
+            return error(400, 'Invalid action')
+        return error(405, 'Method not allowed')
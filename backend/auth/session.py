@@ -0,0 +1,63 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Optional
+
+# Stateless session tokens, shipped with every function: auth issues them,
+# users and messages verify them locally without touching the database.
+#
+# A token is "<user id>.<expiry unix time>.<signature>", the signature being
+# the unpadded urlsafe-base64 HMAC-SHA256 of "<user id>.<expiry>" under
+# SESSION_SECRET. While SESSION_SECRET is unset, tokens are not issued and
+# requests are anonymous, unless TRUST_USER_ID_HEADER=1 explicitly opts into
+# taking the caller from the bare X-User-Id header (local tools, old deployments).
+
+SECRET = os.environ.get('SESSION_SECRET', '')
+TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(30 * 24 * 3600)))
+TRUST_USER_ID_HEADER = not SECRET and os.environ.get('TRUST_USER_ID_HEADER') == '1'
+
+if not SECRET:
+    logging.getLogger(__name__).warning(
+        'SESSION_SECRET is unset: sessions are disabled and %s',
+        'X-User-Id is trusted as is (TRUST_USER_ID_HEADER=1)' if TRUST_USER_ID_HEADER
+        else 'every request is unauthenticated'
+    )
+
+# Keyed HMAC state, copied per token so the key is only processed once
+_mac = hmac.new(SECRET.encode(), digestmod=hashlib.sha256) if SECRET else None
+
+
+def enabled() -> bool:
+    return _mac is not None
+
+
+def _sign(message: bytes) -> str:
+    mac = _mac.copy()
+    mac.update(message)
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b'=').decode()
+
+
+def issue(user_id: int, now: Optional[float] = None) -> Optional[str]:
+    '''Token for user_id valid for TTL_SECONDS, or None while sessions are disabled'''
+    if _mac is None:
+        return None
+    claims = f'{user_id}.{int(now if now is not None else time.time()) + TTL_SECONDS}'
+    return f'{claims}.{_sign(claims.encode())}'
+
+
+def verify(token: str, now: Optional[float] = None) -> Optional[int]:
+    '''User id of a valid, unexpired token, None otherwise'''
+    if _mac is None or not token:
+        return None
+    claims, _, signature = token.rpartition('.')
+    user_id, _, expires = claims.partition('.')
+    if not (user_id.isdigit() and expires.isdigit()):
+        return None
+    if not hmac.compare_digest(_sign(claims.encode()), signature):
+        return None
+    if int(expires) < (now if now is not None else time.time()):
+        return None
+    return int(user_id)
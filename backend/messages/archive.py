@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+from datetime import date
+from typing import Any, Dict, List
+
+from psycopg2 import errors
+
+import db
+
+# Retention for the monthly messages partitions (db_migrations/V0013). Partitions
+# that ended more than MESSAGES_RETENTION_MONTHS ago are folded into
+# messages_archive and dropped; upcoming months get their partitions ahead of
+# time. Meant to run from a scheduled trigger or by hand: python archive.py [--dry-run]
+#
+# Folding a partition takes three transactions so the ACCESS EXCLUSIVE lock that
+# DETACH needs on messages covers no row copying:
+#   1. copy its live rows into messages_archive while it is still attached
+#      (messages_history hides those copies until then, see V0017);
+#   2. detach it, waiting at most DETACH_LOCK_TIMEOUT per attempt for the lock;
+#   3. reconcile the archive with the now frozen table, then drop it.
+# DETACH ... CONCURRENTLY would avoid the exclusive lock, but Postgres refuses it
+# while messages has a default partition.
+
+RETENTION_MONTHS = int(os.environ.get('MESSAGES_RETENTION_MONTHS', '12'))
+PARTITIONS_AHEAD = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '2'))
+DETACH_LOCK_TIMEOUT = os.environ.get('MESSAGES_DETACH_LOCK_TIMEOUT', '2s')
+DETACH_ATTEMPTS = int(os.environ.get('MESSAGES_DETACH_ATTEMPTS', '5'))
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def ensure_partitions(cur: Any, today: date, ahead: int = PARTITIONS_AHEAD) -> List[str]:
+    '''Creates the partitions of the current month and the next `ahead` months'''
+    first = date(today.year, today.month, 1)
+    names = []
+    for offset in range(ahead + 1):
+        cur.execute("SELECT create_messages_partition(%s)", (add_months(first, offset),))
+        names.append(cur.fetchone()[0])
+    return names
+
+
+def cold_partitions(cur: Any, cutoff: date) -> List[Dict[str, Any]]:
+    '''
+    Monthly partitions of messages whose range ends on or before cutoff, oldest first.
+    Tables a previous run detached but did not get to drop come back with detached=True.
+    '''
+    cur.execute(
+        """
+        SELECT c.relname, i.inhrelid IS NULL
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'messages'::regclass
+        WHERE c.relkind = 'r' AND c.relnamespace = 'public'::regnamespace
+        AND c.relname ~ '^messages_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY c.relname
+        """
+    )
+    partitions = []
+    for name, detached in cur.fetchall():
+        start = date(int(name[10:14]), int(name[15:17]), 1)
+        if add_months(start, 1) <= cutoff:
+            partitions.append({'name': name, 'month': start.isoformat(), 'detached': detached})
+    return partitions
+
+
+def copy_live_rows(cur: Any, name: str) -> int:
+    '''Copies the live rows of one partition into messages_archive in conversation order'''
+    cur.execute(
+        f"""
+        INSERT INTO messages_archive (id, sender_id, receiver_id, message_text, created_at)
+        SELECT id, sender_id, receiver_id, message_text, created_at FROM "{name}"
+        WHERE deleted_at IS NULL
+        ORDER BY sender_id, receiver_id, created_at, id
+        ON CONFLICT DO NOTHING
+        """
+    )
+    return cur.rowcount
+
+
+def detach(conn: Any, name: str, attempts: int = DETACH_ATTEMPTS) -> None:
+    '''
+    Detaches one partition in a transaction of its own. A DETACH waiting for its lock
+    queues every later query on messages behind it, so it gives up after
+    DETACH_LOCK_TIMEOUT and retries with a growing pause.
+    '''
+    for attempt in range(attempts):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (DETACH_LOCK_TIMEOUT,))
+                cur.execute(f'ALTER TABLE messages DETACH PARTITION "{name}"')
+            conn.commit()
+            return
+        except errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(attempt + 1)
+
+
+def reconcile_and_drop(cur: Any, name: str) -> int:
+    '''
+    Brings messages_archive in line with a detached partition, which nothing writes to
+    any more, and drops it: rows deleted or sent after the copy are caught up here.
+    Returns the number of rows added.
+    '''
+    cur.execute(
+        f"""
+        DELETE FROM messages_archive a USING "{name}" p
+        WHERE a.id = p.id AND a.created_at = p.created_at AND p.deleted_at IS NOT NULL
+        """
+    )
+    added = copy_live_rows(cur, name)
+    cur.execute(f'DROP TABLE "{name}"')
+    return added
+
+
+def archive_partition(conn: Any, partition: Dict[str, Any]) -> int:
+    '''Folds one partition into messages_archive and drops it. Returns the number of archived rows.'''
+    name = partition['name']
+    count = 0
+    if not partition['detached']:
+        with conn.cursor() as cur:
+            count = copy_live_rows(cur, name)
+        conn.commit()
+        detach(conn, name)
+    with conn.cursor() as cur:
+        count += reconcile_and_drop(cur, name)
+    conn.commit()
+    return count
+
+
+def run(today: date, retention_months: int = RETENTION_MONTHS, dry_run: bool = False) -> Dict[str, Any]:
+    cutoff = add_months(date(today.year, today.month, 1), -retention_months)
+    report: Dict[str, Any] = {'cutoff': cutoff.isoformat(), 'created': [], 'archived': []}
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            if not dry_run:
+                report['created'] = ensure_partitions(cur, today)
+                conn.commit()
+            for partition in cold_partitions(cur, cutoff):
+                if not dry_run:
+                    partition['rows'] = archive_partition(conn, partition)
+                report['archived'].append(partition)
+            if report['archived'] and not dry_run:
+                cur.execute("ANALYZE messages_archive")
+    return report
+
+
+if __name__ == '__main__':
+    # python archive.py [--dry-run]  (uses DATABASE_URL)
+    result = run(date.today(), dry_run='--dry-run' in sys.argv[1:])
+    for partition in result['archived']:
+        print(f"{'Would archive' if 'rows' not in partition else 'Archived'} {partition['name']}"
+              + (f" ({partition['rows']} rows)" if 'rows' in partition else ''))
+    print(f"Partitions ensured: {', '.join(result['created']) or 'none'}; cutoff {result['cutoff']}")
@@ -0,0 +1,225 @@
+import hashlib
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db
+
+# Per (user, partner) summary rows backing the chat list. Every write path of
+# the messages function updates them in the same transaction as the message.
+
+REBUILD_SQL = """
+    WITH pairs AS (
+        SELECT sender_id AS user_id, receiver_id AS partner_id, id, message_text, created_at
+        FROM messages_history
+        WHERE deleted_at IS NULL AND (%(user_ids)s::int[] IS NULL OR sender_id = ANY(%(user_ids)s))
+        UNION ALL
+        SELECT receiver_id, sender_id, id, message_text, created_at
+        FROM messages_history
+        WHERE deleted_at IS NULL AND receiver_id <> sender_id
+        AND (%(user_ids)s::int[] IS NULL OR receiver_id = ANY(%(user_ids)s))
+    ), latest AS (
+        SELECT DISTINCT ON (user_id, partner_id) user_id, partner_id, id, message_text, created_at
+        FROM pairs
+        ORDER BY user_id, partner_id, created_at DESC, id DESC
+    )
+    INSERT INTO conversations (user_id, partner_id, last_message_id, last_message_text, last_message_at, last_read_id, unread_count)
+    SELECT l.user_id, l.partner_id, l.id, l.message_text, l.created_at, COALESCE(p.last_read_id, 0),
+        (SELECT COUNT(*) FROM messages m
+         WHERE m.sender_id = l.partner_id AND m.receiver_id = l.user_id AND m.sender_id <> m.receiver_id
+         AND m.id > COALESCE(p.last_read_id, 0) AND m.deleted_at IS NULL)
+    FROM latest l
+    LEFT JOIN read_pointers p ON p.user_id = l.user_id AND p.partner_id = l.partner_id
+"""
+
+def pair_key(user_id: int, partner_id: int) -> int:
+    '''Advisory lock key of a conversation, the same from either side'''
+    low, high = sorted((int(user_id), int(partner_id)))
+    return (low << 32) | high
+
+
+def lock_pairs(cur: Any, sender_id: int, receiver_ids: Iterable[int]) -> None:
+    '''
+    Holds the conversations of sender_id with receiver_ids until commit. Every write that
+    takes a message revision locks its pair first, so revisions of one conversation commit
+    in the order they were taken and a delta cursor (the highest revision a reader has
+    seen) can never pass a revision that is still in flight. Keys are taken in ascending
+    order so batches cannot deadlock.
+    '''
+    keys = sorted({pair_key(sender_id, receiver_id) for receiver_id in receiver_ids})
+    cur.execute("SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) k", (keys,))
+
+
+def _upsert(cur: Any, rows: List[Tuple[int, int, int, str, datetime, int]]) -> None:
+    '''
+    rows are (user_id, partner_id, message_id, text, created_at, unread increment); each
+    conversation moves to its message unless it already shows a newer one
+    '''
+    # Lock rows in key order so two users writing to each other cannot deadlock
+    rows.sort()
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows))
+    params: List[Any] = [value for row in rows for value in row]
+    cur.execute(
+        f"""
+        INSERT INTO conversations (user_id, partner_id, last_message_id, last_message_text, last_message_at, unread_count)
+        VALUES {values}
+        ON CONFLICT (user_id, partner_id) DO UPDATE SET
+            last_message_id = GREATEST(conversations.last_message_id, EXCLUDED.last_message_id),
+            last_message_text = CASE WHEN EXCLUDED.last_message_id > conversations.last_message_id
+                THEN EXCLUDED.last_message_text ELSE conversations.last_message_text END,
+            last_message_at = CASE WHEN EXCLUDED.last_message_id > conversations.last_message_id
+                THEN EXCLUDED.last_message_at ELSE conversations.last_message_at END,
+            unread_count = conversations.unread_count + EXCLUDED.unread_count
+        """,
+        params
+    )
+
+
+def record_message(cur: Any, message_id: int, sender_id: int, receiver_id: int,
+                   message_text: str, created_at: datetime) -> None:
+    '''Moves both sides of the conversation to the new message and bumps the receiver's unread counter'''
+    record_messages(cur, sender_id, [(message_id, receiver_id, message_text)], created_at)
+
+
+def record_messages(cur: Any, sender_id: int, messages: List[Tuple[int, int, str]], created_at: datetime) -> None:
+    '''
+    record_message() for a batch of (message_id, receiver_id, text) from one sender, in one
+    statement: every conversation moves to its newest message of the batch and the
+    receiver's unread counter grows by the number of messages it got
+    '''
+    latest: Dict[int, Tuple[int, str]] = {}
+    counts: Dict[int, int] = {}
+    for message_id, receiver_id, message_text in messages:
+        if message_id > latest.get(receiver_id, (0, ''))[0]:
+            latest[receiver_id] = (message_id, message_text)
+        counts[receiver_id] = counts.get(receiver_id, 0) + 1
+    rows = []
+    for receiver_id, (message_id, message_text) in latest.items():
+        rows.append((sender_id, receiver_id, message_id, message_text, created_at, 0))
+        if receiver_id != sender_id:
+            rows.append((receiver_id, sender_id, message_id, message_text, created_at, counts[receiver_id]))
+    _upsert(cur, rows)
+
+
+def record_deletion(cur: Any, message_id: int, sender_id: int, receiver_id: int) -> None:
+    '''Points summaries that showed the deleted message at the previous one, or drops them if none is left'''
+    cur.execute(
+        """
+        UPDATE conversations SET unread_count = GREATEST(unread_count - 1, 0)
+        WHERE user_id = %s AND partner_id = %s AND last_read_id < %s AND user_id <> partner_id
+        """,
+        (receiver_id, sender_id, message_id)
+    )
+    cur.execute(
+        """
+        UPDATE conversations c
+        SET last_message_id = m.id, last_message_text = m.message_text, last_message_at = m.created_at
+        FROM (
+            SELECT id, message_text, created_at FROM messages_history
+            WHERE ((sender_id = %s AND receiver_id = %s) OR (sender_id = %s AND receiver_id = %s))
+            AND deleted_at IS NULL
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) m
+        WHERE c.last_message_id = %s
+        AND ((c.user_id = %s AND c.partner_id = %s) OR (c.user_id = %s AND c.partner_id = %s))
+        """,
+        (sender_id, receiver_id, receiver_id, sender_id, message_id,
+         sender_id, receiver_id, receiver_id, sender_id)
+    )
+    cur.execute(
+        """
+        DELETE FROM conversations
+        WHERE last_message_id = %s
+        AND ((user_id = %s AND partner_id = %s) OR (user_id = %s AND partner_id = %s))
+        """,
+        (message_id, sender_id, receiver_id, receiver_id, sender_id)
+    )
+
+
+def mark_read(cur: Any, user_id: int, partner_id: int, up_to: int) -> Tuple[int, int, bool]:
+    '''
+    Moves user_id's read pointer for messages from partner_id forward to up_to
+    (never past the conversation's last message) and recounts what is left unread.
+    Returns (read pointer, unread count, whether the pointer moved).
+    '''
+    cur.execute(
+        """
+        WITH moved AS (
+            UPDATE conversations c
+            SET last_read_id = LEAST(%(up_to)s, c.last_message_id),
+                unread_count = (
+                    SELECT COUNT(*) FROM messages m
+                    WHERE m.sender_id = c.partner_id AND m.receiver_id = c.user_id AND m.sender_id <> m.receiver_id
+                    AND m.id > LEAST(%(up_to)s, c.last_message_id) AND m.deleted_at IS NULL
+                )
+            WHERE c.user_id = %(user_id)s AND c.partner_id = %(partner_id)s
+            AND c.last_read_id < LEAST(%(up_to)s, c.last_message_id)
+            RETURNING c.last_read_id, c.unread_count
+        )
+        SELECT last_read_id, unread_count, TRUE FROM moved
+        UNION ALL
+        SELECT last_read_id, unread_count, FALSE FROM conversations
+        WHERE user_id = %(user_id)s AND partner_id = %(partner_id)s AND NOT EXISTS (SELECT 1 FROM moved)
+        """,
+        {'user_id': user_id, 'partner_id': partner_id, 'up_to': up_to}
+    )
+    row = cur.fetchone()
+    return (row[0], row[1], row[2]) if row else (0, 0, False)
+
+
+def summary_version(rows: Iterable[Tuple[int, int, int]]) -> str:
+    '''
+    Fingerprint of a user's chat list from its (partner_id, last_message_id, unread_count)
+    rows. Sends, deletions (which can move last_message_id back or drop the row) and
+    mark_read all change it, whatever order they commit in.
+    '''
+    digest = hashlib.md5()
+    for partner_id, last_message_id, unread_count in sorted(rows):
+        digest.update(f'{partner_id}:{last_message_id}:{unread_count},'.encode())
+    return digest.hexdigest()[:16]
+
+
+def read_pointers(cur: Any, user_id: int, partner_id: int) -> Dict[int, int]:
+    '''Read pointers of both sides of a conversation, keyed by the reader's user id'''
+    cur.execute(
+        """
+        SELECT user_id, last_read_id FROM conversations
+        WHERE (user_id = %s AND partner_id = %s) OR (user_id = %s AND partner_id = %s)
+        """,
+        (user_id, partner_id, partner_id, user_id)
+    )
+    return dict(cur.fetchall())
+
+
+def rebuild(cur: Any, user_ids: Optional[List[int]] = None) -> int:
+    '''
+    Recomputes summaries from the messages table, for everybody or only for the given users.
+    Returns the number of summary rows written.
+    '''
+    # Read pointers are state of their own and survive the rebuild
+    cur.execute(
+        """
+        CREATE TEMP TABLE read_pointers AS
+        SELECT user_id, partner_id, last_read_id FROM conversations
+        WHERE %(user_ids)s::int[] IS NULL OR user_id = ANY(%(user_ids)s)
+        """,
+        {'user_ids': user_ids}
+    )
+    cur.execute(
+        "DELETE FROM conversations WHERE %(user_ids)s::int[] IS NULL OR user_id = ANY(%(user_ids)s)",
+        {'user_ids': user_ids}
+    )
+    cur.execute(REBUILD_SQL, {'user_ids': user_ids})
+    count = cur.rowcount
+    cur.execute("DROP TABLE read_pointers")
+    return count
+
+
+if __name__ == '__main__':
+    # python conversations.py [user_id ...]  (uses DATABASE_URL)
+    ids = [int(arg) for arg in sys.argv[1:]] or None
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            count = rebuild(cur, ids)
+    print(f'Rebuilt {count} conversation summaries')
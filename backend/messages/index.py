@@ -1,180 +1,494 @@
-import json
 import os
-import psycopg2
-from typing import Dict, Any, List
+import zlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+import conversations
+import db
+import longpoll
+import profiles
+import runtime
+import tracing
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Months of partitions a conversation page reads before reaching further back
+PAGE_WINDOW_MONTHS = 2
+
+# Names and avatars are not joined in; responses carry them once, in `profiles` (profiles.py)
+MESSAGE_COLUMNS = "m.id, m.sender_id, m.receiver_id, m.message_text, m.created_at"
+MESSAGE_KEYS = ('id', 'sender_id', 'receiver_id', 'message_text', 'created_at')
+CHAT_KEYS = ('id', 'lastMessage', 'time', 'unread')
+# Rows per FETCH of the export cursor. Only one batch of rows is held at a time, but the
+# gateway takes the body in one piece, so an export still holds its whole gzip output and
+# that output's base64 encoding: memory grows with the compressed size of the conversation
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+SEARCH_MAX_QUERY_LENGTH = 200
+# Upper bounds for one send_batch call; larger fan-outs are split by the caller
+SEND_BATCH_MAX_ITEMS = int(os.environ.get('SEND_BATCH_MAX_ITEMS', '1000'))
+SEND_BATCH_MAX_BYTES = int(os.environ.get('SEND_BATCH_MAX_BYTES', str(1024 * 1024)))
+
+# Conversation page over messages or messages_history, limited to a range of monthly partitions
+PAGE_SQL = f"""
+    SELECT {MESSAGE_COLUMNS}
+    FROM {{source}} m
+    WHERE ((m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s))
+    AND m.deleted_at IS NULL
+    AND (%s::timestamp IS NULL OR m.created_at <= %s)
+    AND (%s::timestamp IS NULL OR (m.created_at, m.id) < (%s::timestamp, %s))
+    AND {{window}}
+    ORDER BY m.created_at DESC, m.id DESC
+    LIMIT %s
+"""
+
+# Messages of the caller's conversations matching a full-text query (db_migrations/V0015), best
+# match first; keyset-paginated on (rank, id)
+SEARCH_SQL = f"""
+    SELECT {MESSAGE_COLUMNS}, m.rank
+    FROM (
+        SELECT h.id, h.sender_id, h.receiver_id, h.message_text, h.created_at,
+               ts_rank(h.search_vector, q.query) AS rank
+        FROM messages_history h, websearch_to_tsquery('russian', %(query)s) q(query)
+        WHERE h.search_vector @@ q.query
+        AND (h.sender_id = %(user_id)s OR h.receiver_id = %(user_id)s)
+        AND h.deleted_at IS NULL
+    ) m
+    WHERE %(after_rank)s::real IS NULL OR (m.rank, m.id) < (%(after_rank)s::real, %(after_id)s)
+    ORDER BY m.rank DESC, m.id DESC
+    LIMIT %(limit)s
+"""
+
+def message_to_dict(row: Tuple, read_ids: Dict[int, int]) -> Dict[str, Any]:
+    '''read_ids maps a user id to that user's read pointer in this conversation'''
+    return dict(zip(MESSAGE_KEYS, row), is_read=row[0] <= read_ids.get(row[2], 0))
+
+def page_cursor(row: Tuple) -> str:
+    '''Keyset cursor pointing at the oldest message of a page: "<created_at>|<id>"'''
+    return f'{row[4].isoformat()}|{row[0]}'
+
+def parse_page_cursor(cursor: str) -> Tuple[datetime, int]:
+    '''Inverse of page_cursor; raises ValueError on anything else'''
+    created_at, message_id = cursor.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(message_id)
+
+def page_limit(value: Optional[str]) -> int:
+    '''?limit= clamped to [1, MAX_PAGE_SIZE]; raises ValueError when it is not a number'''
+    return min(max(int(value or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+
+def page_rows(cur: Any, user_id: int, other_user_id: int, before_created_at: Optional[datetime],
+              before_id: Optional[int], count: int) -> List[Tuple]:
     '''
-    Business: Send, retrieve and delete messages between users
-    Args: event with httpMethod, body, headers
-    Returns: HTTP response with messages or status
+    Up to count messages of a conversation older than the (created_at, id) cursor, newest first.
+    Reads the monthly partitions of the recent window first and only goes further back when
+    the window does not fill the page. Only history pages (with a cursor) read the archive.
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+    window_start = "date_trunc('month', COALESCE(%s::timestamp, LOCALTIMESTAMP)) - %s * INTERVAL '1 month'"
+    params = (user_id, other_user_id, other_user_id, user_id,
+              before_created_at, before_created_at,
+              before_created_at, before_created_at, before_id,
+              before_created_at, PAGE_WINDOW_MONTHS - 1)
+    source = 'messages_history' if before_created_at else 'messages'
+    cur.execute(PAGE_SQL.format(source=source, window=f'm.created_at >= {window_start}'), params + (count,))
+    rows = cur.fetchall()
+    if len(rows) < count:
+        cur.execute(PAGE_SQL.format(source='messages_history', window=f'm.created_at < {window_start}'),
+                    params + (count - len(rows),))
+        rows.extend(cur.fetchall())
+    return rows
+
+def conversation_changes(conn: Any, cur: Any, user_id: int, other_user_id: int,
+                         since: int, wait: float) -> runtime.Response:
+    read_ids = conversations.read_pointers(cur, user_id, other_user_id)
+    partner_read_id = read_ids.get(other_user_id, 0)
     
-    headers = event.get('headers', {})
-    user_id_str = headers.get('X-User-Id') or headers.get('x-user-id')
+    def fetch_changes() -> bool:
+        nonlocal rows, read_ids
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}, m.revision, m.deleted_at
+            FROM messages m
+            WHERE ((m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s))
+            AND m.revision > %s
+            ORDER BY m.revision ASC
+        """, (user_id, other_user_id, other_user_id, user_id, since))
+        rows = cur.fetchall()
+        if not rows:
+            read_ids = conversations.read_pointers(cur, user_id, other_user_id)
+        return bool(rows) or read_ids.get(other_user_id, 0) != partner_read_id
     
-    if not user_id_str:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'User ID required'})
-        }
+    rows: List[Tuple] = []
+    changed = fetch_changes()
+    waited = True
+    if not changed and wait:
+        changed, waited = longpoll.wait_for(conn, user_id, wait, fetch_changes)
+    
+    result = {
+        'messages': [message_to_dict(row, read_ids) for row in rows if row[6] is None],
+        'deleted': [row[0] for row in rows if row[6] is not None],
+        'cursor': rows[-1][5] if rows else since,
+        'read_id': read_ids.get(user_id, 0),
+        'partner_read_id': read_ids.get(other_user_id, 0),
+        'profiles': profiles.lookup(cur, (user_id, other_user_id))
+    }
+    if not changed and not waited:
+        result['retry_after'] = longpoll.RETRY_AFTER
+    return runtime.ok(result)
+
+def conversation_page(cur: Any, user_id: int, other_user_id: int,
+                      before: Optional[Tuple[datetime, int]], limit: int) -> runtime.Response:
+    cursor = None
+    if not before:
+        cur.execute(
+            """
+            SELECT COALESCE(MAX(revision), 0) FROM messages
+            WHERE (sender_id = %s AND receiver_id = %s) OR (sender_id = %s AND receiver_id = %s)
+            """,
+            (user_id, other_user_id, other_user_id, user_id)
+        )
+        cursor = cur.fetchone()[0]
+    
+    before_created_at, before_id = before or (None, None)
+    rows = page_rows(cur, user_id, other_user_id, before_created_at, before_id, limit + 1)
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    read_ids = conversations.read_pointers(cur, user_id, other_user_id)
+    result = {
+        'messages': [message_to_dict(row, read_ids) for row in rows],
+        'has_more': has_more,
+        'before': page_cursor(rows[0]) if has_more else None,
+        'read_id': read_ids.get(user_id, 0),
+        'partner_read_id': read_ids.get(other_user_id, 0),
+        'profiles': profiles.lookup(cur, (user_id, other_user_id))
+    }
+    if cursor is not None:
+        result['cursor'] = cursor
+    return runtime.ok(result)
+
+def export_conversation(conn: Any, user_id: int, other_user_id: int, export_format: str) -> runtime.Response:
+    '''
+    Whole conversation, archive included, oldest first, as gzip-compressed NDJSON
+    (one message per line) or a JSON array. Rows are read from a server-side cursor
+    EXPORT_BATCH_SIZE at a time and compressed as they arrive.
+    '''
+    with conn.cursor() as cur:
+        read_ids = conversations.read_pointers(cur, user_id, other_user_id)
+        names = profiles.lookup(cur, (user_id, other_user_id))
     
-    user_id = int(user_id_str)
-    dsn = os.environ.get('DATABASE_URL')
+    def export_row(row: Tuple) -> Dict[str, Any]:
+        # Export files stand alone, so every line names its sender and receiver
+        sender, receiver = names.get(row[1], {}), names.get(row[2], {})
+        return dict(message_to_dict(row, read_ids),
+                    sender_name=sender.get('display_name'), sender_avatar=sender.get('avatar'),
+                    receiver_name=receiver.get('display_name'), receiver_avatar=receiver.get('avatar'))
     
-    with psycopg2.connect(dsn) as conn:
+    # wbits=31: zlib stream with a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    # Compressed output is appended in place rather than collected and joined
+    compressed = bytearray(compressor.compress(b'[') if export_format == 'json' else b'')
+    separator = b',' if export_format == 'json' else b'\n'
+    first = True
+    with conn.cursor(name='conversation_export') as cur:
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages_history m
+            WHERE ((m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s))
+            AND m.deleted_at IS NULL
+            ORDER BY m.created_at ASC, m.id ASC
+        """, (user_id, other_user_id, other_user_id, user_id))
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            data = runtime.join_json((export_row(row) for row in rows), separator)
+            if export_format == 'ndjson':
+                data += separator
+            elif not first:
+                data = separator + data
+            first = False
+            compressed += compressor.compress(data)
+    if export_format == 'json':
+        compressed += compressor.compress(b']')
+    compressed += compressor.flush()
+    
+    return runtime.binary(200, compressed, {
+        'Content-Type': EXPORT_FORMATS[export_format],
+        'Content-Encoding': 'gzip',
+        'Content-Disposition': f'attachment; filename="conversation-{other_user_id}.{export_format}"'
+    })
+
+def parse_search_cursor(cursor: str) -> Tuple[float, int]:
+    '''"<rank>|<id>" cursor of a search page; raises ValueError on anything else'''
+    rank, message_id = cursor.rsplit('|', 1)
+    return float(rank), int(message_id)
+
+def search_messages(cur: Any, user_id: int, query: str, after: Optional[Tuple[float, int]], limit: int) -> runtime.Response:
+    '''Ranked full-text matches; `after` is the parsed cursor of the previous page'''
+    after_rank, after_id = after or (None, None)
+    cur.execute(SEARCH_SQL, {
+        'query': query[:SEARCH_MAX_QUERY_LENGTH], 'user_id': user_id,
+        'after_rank': after_rank, 'after_id': after_id, 'limit': limit + 1
+    })
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return runtime.ok({
+        'messages': [dict(zip(MESSAGE_KEYS, row), rank=row[5]) for row in rows],
+        'profiles': profiles.lookup(cur, [user_id] + [row[1] for row in rows] + [row[2] for row in rows]),
+        'after': f'{rows[-1][5]}|{rows[-1][0]}' if has_more else None
+    })
+
+def chat_list(conn: Any, cur: Any, user_id: int, since: Optional[str], wait: float) -> runtime.Response:
+    if since is not None and wait:
+        def has_news() -> bool:
+            cur.execute(
+                "SELECT partner_id, last_message_id, unread_count FROM conversations WHERE user_id = %s",
+                (user_id,)
+            )
+            return conversations.summary_version(cur.fetchall()) != since
+        
+        changed, waited = longpoll.wait_for(conn, user_id, wait, has_news)
+        if not changed:
+            result = {'unchanged': True, 'cursor': since}
+            if not waited:
+                result['retry_after'] = longpoll.RETRY_AFTER
+            return runtime.ok(result)
+    
+    cur.execute("""
+        SELECT c.partner_id, c.last_message_text, c.last_message_at, c.unread_count, c.last_message_id
+        FROM conversations c
+        WHERE c.user_id = %s
+        ORDER BY c.last_message_at DESC
+    """, (user_id,))
+    rows = cur.fetchall()
+    return runtime.ok({
+        'chats': runtime.rows_to_dicts(CHAT_KEYS, rows),
+        'profiles': profiles.lookup(cur, [row[0] for row in rows]),
+        'cursor': conversations.summary_version((row[0], row[4], row[3]) for row in rows)
+    })
+
+def get_messages(request: runtime.Request) -> runtime.Response:
+    query_params = request.query
+    since = query_params.get('since')
+    export_format = query_params.get('export')
+    if export_format is not None and (export_format not in EXPORT_FORMATS or not query_params.get('userId')):
+        return runtime.error(400, 'Unsupported export')
+    try:
+        other_user_id = int(query_params['userId']) if query_params.get('userId') else None
+        # The chat list's since is an opaque version, a conversation's a revision
+        revision = int(since) if since is not None and other_user_id else None
+        before = parse_page_cursor(query_params['before']) if query_params.get('before') else None
+        limit = page_limit(query_params.get('limit'))
+        wait = longpoll.wait_seconds(query_params.get('wait'))
+        after = parse_search_cursor(query_params['after']) if query_params.get('after') else None
+    except ValueError:
+        return runtime.error(400, 'Invalid userId, since, before, after, limit or wait')
+    
+    with db.connection() as conn:
+        profiles.sync(conn)
+        if export_format is not None:
+            return export_conversation(conn, request.user_id, other_user_id, export_format)
         with conn.cursor() as cur:
-            if method == 'GET':
-                query_params = event.get('queryStringParameters') or {}
-                other_user_id = query_params.get('userId')
-                
-                if other_user_id:
-                    cur.execute("""
-                        SELECT m.id, m.sender_id, m.receiver_id, m.message_text, m.is_read, m.created_at,
-                               u1.display_name as sender_name, u1.avatar as sender_avatar,
-                               u2.display_name as receiver_name, u2.avatar as receiver_avatar
-                        FROM messages m
-                        JOIN users u1 ON m.sender_id = u1.id
-                        JOIN users u2 ON m.receiver_id = u2.id
-                        WHERE (m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s)
-                        ORDER BY m.created_at ASC
-                    """, (user_id, int(other_user_id), int(other_user_id), user_id))
-                    
-                    messages = []
-                    for row in cur.fetchall():
-                        messages.append({
-                            'id': row[0],
-                            'sender_id': row[1],
-                            'receiver_id': row[2],
-                            'message_text': row[3],
-                            'is_read': row[4],
-                            'created_at': row[5].isoformat(),
-                            'sender_name': row[6],
-                            'sender_avatar': row[7],
-                            'receiver_name': row[8],
-                            'receiver_avatar': row[9]
-                        })
-                    
-                    cur.execute(
-                        "UPDATE messages SET is_read = TRUE WHERE receiver_id = %s AND sender_id = %s AND is_read = FALSE",
-                        (user_id, int(other_user_id))
-                    )
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'messages': messages})
-                    }
-                else:
-                    cur.execute("""
-                        SELECT DISTINCT ON (other_user_id) 
-                            other_user_id, u.display_name, u.avatar, u.status,
-                            m.message_text as last_message,
-                            m.created_at,
-                            (SELECT COUNT(*) FROM messages WHERE receiver_id = %s AND sender_id = other_user_id AND is_read = FALSE) as unread_count
-                        FROM (
-                            SELECT 
-                                CASE WHEN sender_id = %s THEN receiver_id ELSE sender_id END as other_user_id,
-                                id, message_text, created_at
-                            FROM messages
-                            WHERE sender_id = %s OR receiver_id = %s
-                        ) m
-                        JOIN users u ON u.id = m.other_user_id
-                        ORDER BY other_user_id, m.created_at DESC
-                    """, (user_id, user_id, user_id, user_id))
-                    
-                    chats = []
-                    for row in cur.fetchall():
-                        chats.append({
-                            'id': row[0],
-                            'name': row[1],
-                            'avatar': row[2],
-                            'status': row[3],
-                            'lastMessage': row[4],
-                            'time': row[5].isoformat(),
-                            'unread': row[6]
-                        })
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'chats': chats})
-                    }
-            
-            elif method == 'DELETE':
-                query_params = event.get('queryStringParameters') or {}
-                message_id = query_params.get('messageId')
-                
-                if not message_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Message ID required'})
-                    }
-                
-                cur.execute(
-                    "DELETE FROM messages WHERE id = %s AND sender_id = %s",
-                    (int(message_id), user_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'status': 'message deleted'})
-                }
+            if query_params.get('search'):
+                return search_messages(cur, request.user_id, query_params['search'], after, limit)
+            if not other_user_id:
+                return chat_list(conn, cur, request.user_id, since, wait)
+            if revision is not None:
+                return conversation_changes(conn, cur, request.user_id, other_user_id, revision, wait)
+            return conversation_page(cur, request.user_id, other_user_id, before, limit)
+
+def remove_message(cur: Any, user_id: int, message_id: int) -> Optional[int]:
+    '''
+    Write path of delete_message inside the caller's transaction. Messages in the
+    partitions are soft-deleted so deltas report them; archived ones are removed from
+    messages_archive, together with the copy archive.py makes before it detaches a partition.
+    Returns the receiver, or None when user_id sent no such live message.
+    '''
+    cur.execute(
+        "SELECT receiver_id FROM messages_history WHERE id = %s AND sender_id = %s AND deleted_at IS NULL",
+        (message_id, user_id)
+    )
+    found = cur.fetchone()
+    if not found:
+        return None
+    # The deletion takes a new revision, so it queues behind writes in flight (see lock_pairs)
+    conversations.lock_pairs(cur, user_id, [found[0]])
+    cur.execute(
+        """
+        UPDATE messages SET deleted_at = CURRENT_TIMESTAMP, revision = nextval('messages_revision_seq')
+        WHERE id = %s AND sender_id = %s AND deleted_at IS NULL
+        RETURNING receiver_id
+        """,
+        (message_id, user_id)
+    )
+    deleted = cur.fetchone()
+    cur.execute(
+        "DELETE FROM messages_archive WHERE id = %s AND sender_id = %s RETURNING receiver_id",
+        (message_id, user_id)
+    )
+    deleted = deleted or cur.fetchone()
+    if not deleted:
+        return None
+    conversations.record_deletion(cur, message_id, user_id, deleted[0])
+    longpoll.notify_many(cur, [deleted[0], user_id], str(user_id))
+    return deleted[0]
+
+def delete_message(request: runtime.Request) -> runtime.Response:
+    message_id = request.query.get('messageId')
+    if not message_id:
+        return runtime.error(400, 'Message ID required')
+    
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            if remove_message(cur, request.user_id, int(message_id)) is None:
+                return runtime.error(404, 'Message not found')
+    
+    return runtime.ok({'status': 'message deleted'})
+
+def mark_read(request: runtime.Request) -> runtime.Response:
+    partner_id = request.body.get('user_id')
+    up_to = request.body.get('up_to')
+    if not partner_id or not up_to:
+        return runtime.error(400, 'User ID and message ID required')
+    
+    user_id = request.user_id
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            read_id, unread, moved = conversations.mark_read(cur, user_id, int(partner_id), int(up_to))
+            if moved:
+                # The partner's delta shows the read pointer, the caller's other devices the unread count
+                longpoll.notify_many(cur, [int(partner_id), user_id], str(user_id))
+    
+    return runtime.ok({'read_id': read_id, 'unread': unread})
+
+def store_message(cur: Any, sender_id: int, receiver_id: int, message_text: str) -> Tuple[int, datetime]:
+    '''Write path of send_message inside the caller's transaction; returns (id, created_at)'''
+    conversations.lock_pairs(cur, sender_id, [receiver_id])
+    cur.execute(
+        "INSERT INTO messages (sender_id, receiver_id, message_text) VALUES (%s, %s, %s) RETURNING id, created_at",
+        (sender_id, receiver_id, message_text)
+    )
+    message_id, created_at = cur.fetchone()
+    conversations.record_message(cur, message_id, sender_id, receiver_id, message_text, created_at)
+    longpoll.notify_many(cur, [receiver_id, sender_id], str(sender_id))
+    return message_id, created_at
+
+def send_message(request: runtime.Request) -> runtime.Response:
+    receiver_id = request.body.get('receiver_id')
+    message_text = request.body.get('message_text', '').strip()
+    if not receiver_id or not message_text:
+        return runtime.error(400, 'Receiver ID and message text required')
+    
+    user_id = request.user_id
+    receiver_id = int(receiver_id)
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            message_id, created_at = store_message(cur, user_id, receiver_id, message_text)
+    
+    return runtime.ok({
+        'message': {
+            'id': message_id,
+            'sender_id': user_id,
+            'receiver_id': receiver_id,
+            'message_text': message_text,
+            'created_at': created_at
+        }
+    })
+
+def batch_items(body: Dict[str, Any]) -> Optional[List[Tuple[int, str]]]:
+    '''(receiver_id, text) pairs from {items: [{receiver_id, message_text}]} or {message_text, receiver_ids}'''
+    if 'items' in body:
+        pairs = [(item.get('receiver_id'), item.get('message_text')) for item in body['items'] or []]
+    else:
+        pairs = [(receiver_id, body.get('message_text')) for receiver_id in body.get('receiver_ids') or []]
+    items = []
+    for receiver_id, message_text in pairs:
+        message_text = (message_text or '').strip()
+        if not receiver_id or not message_text:
+            return None
+        items.append((int(receiver_id), message_text))
+    return items
+
+def store_batch(cur: Any, sender_id: int, items: List[Tuple[int, str]]) -> Tuple[List[int], datetime]:
+    '''Write path of send_batch inside the caller's transaction; returns (ids in item order, created_at)'''
+    receiver_ids = [receiver_id for receiver_id, _ in items]
+    texts = [text for _, text in items]
+    # Every conversation in the batch, before any row takes a revision (see lock_pairs)
+    conversations.lock_pairs(cur, sender_id, receiver_ids)
+    # Ids are taken up front so they follow the order of the items
+    cur.execute(
+        "SELECT array_agg(nextval('messages_id_seq')), LOCALTIMESTAMP FROM generate_series(1, %s)",
+        (len(items),)
+    )
+    ids, created_at = cur.fetchone()
+    ids.sort()
+    cur.execute(
+        """
+        INSERT INTO messages (id, sender_id, receiver_id, message_text, created_at)
+        SELECT id, %s, receiver_id, message_text, %s
+        FROM unnest(%s::int[], %s::int[], %s::text[]) AS b(id, receiver_id, message_text)
+        """,
+        (sender_id, created_at, ids, receiver_ids, texts)
+    )
+    conversations.record_messages(cur, sender_id, list(zip(ids, receiver_ids, texts)), created_at)
+    return ids, created_at
+
+def send_batch(request: runtime.Request) -> runtime.Response:
+    items = batch_items(request.body)
+    if not items:
+        return runtime.error(400, 'Receiver ID and message text required for every item')
+    if (len(items) > SEND_BATCH_MAX_ITEMS
+            or sum(len(text.encode()) for _, text in items) > SEND_BATCH_MAX_BYTES):
+        return runtime.error(413, f'Batch too large (max {SEND_BATCH_MAX_ITEMS} messages, {SEND_BATCH_MAX_BYTES} bytes)')
+    
+    user_id = request.user_id
+    receiver_ids = [receiver_id for receiver_id, _ in items]
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            # One batch per sender at a time, so a single sender cannot hold several connections
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('send_batch'), %s)", (user_id,))
+            if not cur.fetchone()[0]:
+                return runtime.error(429, 'Another batch from this sender is in progress')
             
-            elif method == 'POST':
-                body_data = json.loads(event.get('body', '{}'))
-                receiver_id = body_data.get('receiver_id')
-                message_text = body_data.get('message_text', '').strip()
-                
-                if not receiver_id or not message_text:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Receiver ID and message text required'})
-                    }
-                
-                cur.execute(
-                    "INSERT INTO messages (sender_id, receiver_id, message_text) VALUES (%s, %s, %s) RETURNING id, created_at",
-                    (user_id, receiver_id, message_text)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'message': {
-                            'id': result[0],
-                            'sender_id': user_id,
-                            'receiver_id': receiver_id,
-                            'message_text': message_text,
-                            'created_at': result[1].isoformat()
-                        }
-                    })
-                }
+            cur.execute("SELECT array_agg(id) FROM users WHERE id = ANY(%s)", (sorted(set(receiver_ids)),))
+            unknown = sorted(set(receiver_ids) - set(cur.fetchone()[0] or []))
+            if unknown:
+                return runtime.error(400, f'Unknown receivers: {unknown}')
             
-            else:
-                return {
-                    'statusCode': 405,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Method not allowed'})
-                }
\ No newline at end of file
+            ids, created_at = store_batch(cur, user_id, items)
+            longpoll.notify_many(cur, receiver_ids + [user_id], str(user_id))
+    
+    return runtime.ok({
+        'messages': [
+            {'id': message_id, 'receiver_id': receiver_id, 'created_at': created_at}
+            for message_id, receiver_id in zip(ids, receiver_ids)
+        ]
+    })
+
+tracing.stats_providers['profile_cache'] = profiles.stats
+
+router = runtime.Router({
+    ('GET', None): get_messages,
+    ('DELETE', None): delete_message,
+    ('POST', 'mark_read'): mark_read,
+    ('POST', 'send_batch'): send_batch,
+    ('POST', None): send_message,
+}, unauthorized='User ID required')
+
+@tracing.traced('messages')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Send, retrieve and delete messages between users
+    Args: event with httpMethod, body, headers; conversation GET accepts
+          since (revision cursor, returns only changes), before (history page cursor) and limit;
+          with since, wait=<seconds> blocks until something changes (chat list: since=<opaque cursor of the last list>&wait=);
+          export=ndjson|json returns the whole conversation gzip-compressed;
+          search=<text> (with after, limit) finds messages in the caller's conversations;
+          POST {action: mark_read, user_id, up_to} moves the caller's read pointer;
+          POST {action: send_batch, items: [{receiver_id, message_text}]} or
+          {action: send_batch, message_text, receiver_ids} sends many messages at once
+    Returns: HTTP response with messages plus a profiles table keyed by user id, or status
+    '''
+    return router.dispatch(event)
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+import select
+import threading
+import time
+from typing import Any, Callable, Iterable, Tuple
+
+import psycopg2
+
+import db
+import tracing
+
+# Long polling on top of Postgres LISTEN/NOTIFY. Every write that a user should
+# see fires NOTIFY on that user's channel; a waiting request LISTENs on it and
+# re-runs its check when a notification arrives.
+
+MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', '20'))
+MAX_WAITERS = int(os.environ.get('LONG_POLL_MAX_WAITERS', str(max(db.POOL_SIZE - 1, 1))))
+RETRY_AFTER = 3
+
+_waiters = threading.BoundedSemaphore(MAX_WAITERS)
+
+
+def channel(user_id: int) -> str:
+    return f'messages_{int(user_id)}'
+
+
+def notify(cur: Any, user_id: int, payload: str = '') -> None:
+    '''Wakes up requests waiting for user_id once the current transaction commits'''
+    cur.execute("SELECT pg_notify(%s, %s)", (channel(user_id), payload))
+
+
+def notify_many(cur: Any, user_ids: Iterable[int], payload: str = '') -> None:
+    '''notify() for several users with one statement'''
+    channels = sorted({channel(user_id) for user_id in user_ids})
+    if channels:
+        cur.execute("SELECT pg_notify(c, %s) FROM unnest(%s::text[]) c", (payload, channels))
+
+
+def wait_seconds(value: Any) -> float:
+    return min(max(float(value or 0), 0.0), MAX_WAIT)
+
+
+def wait_for(conn: Any, user_id: int, timeout: float, check: Callable[[], Any]) -> Tuple[Any, bool]:
+    '''
+    Blocks until check() returns something truthy or timeout seconds pass,
+    re-running check() whenever user_id gets a notification.
+    Returns (last check() result, waited). waited is False when every waiter
+    slot of this instance is taken; check() is then run once without waiting.
+    '''
+    if not _waiters.acquire(blocking=False):
+        return check(), False
+
+    deadline = time.monotonic() + timeout
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {channel(user_id)}')
+        conn.commit()
+
+        # Re-check after LISTEN so a change committed in between is not missed
+        result = check()
+        conn.commit()
+        while not result:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with tracing.phase('wait'):
+                ready = select.select([conn], [], [], remaining)
+            if ready == ([], [], []):
+                break
+            conn.poll()
+            if any(n.channel == channel(user_id) for n in conn.notifies):
+                conn.notifies[:] = [n for n in conn.notifies if n.channel != channel(user_id)]
+                result = check()
+                conn.commit()
+        return result, True
+    finally:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'UNLISTEN {channel(user_id)}')
+            conn.commit()
+        except psycopg2.Error:
+            pass
+        # Other channels (profiles.CHANNEL) stay subscribed and keep their notifications
+        conn.notifies[:] = [n for n in conn.notifies if n.channel != channel(user_id)]
+        _waiters.release()
@@ -0,0 +1,77 @@
+import os
+import weakref
+from typing import Any, Dict, Iterable
+
+from cache import TTLCache
+
+# Display name, avatar and status per user id. Responses carry them once, in a
+# `profiles` side table, instead of joining users into every row. Entries live
+# in an in-process LRU for PROFILE_CACHE_TTL seconds and are dropped earlier
+# when db_migrations/V0016 announces a change on the profile_changed channel.
+
+CHANNEL = 'profile_changed'
+PROFILE_KEYS = ('display_name', 'avatar', 'status')
+
+profile_cache = TTLCache(
+    maxsize=int(os.environ.get('PROFILE_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('PROFILE_CACHE_TTL', '300'))
+)
+
+# Pooled connections that already LISTEN on CHANNEL
+_listening: 'weakref.WeakSet[Any]' = weakref.WeakSet()
+
+
+def sync(conn: Any) -> None:
+    '''
+    Applies the profile changes conn has been notified about. Call it right
+    after checkout: the first time it LISTENs and commits on its own.
+    '''
+    if conn not in _listening:
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {CHANNEL}')
+        conn.commit()
+        _listening.add(conn)
+    _drain(conn)
+
+
+def _drain(conn: Any) -> None:
+    conn.poll()
+    if not conn.notifies:
+        return
+    remaining = []
+    for notification in conn.notifies:
+        if notification.channel != CHANNEL:
+            remaining.append(notification)
+        elif notification.payload.isdigit():
+            profile_cache.invalidate(int(notification.payload))
+        else:
+            profile_cache.clear()
+    conn.notifies[:] = remaining
+
+
+def lookup(cur: Any, user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    '''Profiles of user_ids keyed by id; misses are loaded with one query'''
+    # Changes that arrived while the request ran, e.g. during a long poll
+    _drain(cur.connection)
+    result: Dict[int, Dict[str, Any]] = {}
+    missing = []
+    for user_id in set(user_ids):
+        profile = profile_cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            result[user_id] = profile
+    if missing:
+        cur.execute("SELECT id, display_name, avatar, status FROM users WHERE id = ANY(%s)", (sorted(missing),))
+        for row in cur.fetchall():
+            profile = dict(zip(PROFILE_KEYS, row[1:]))
+            profile_cache.set(row[0], profile)
+            result[row[0]] = profile
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    counters: Dict[str, Any] = profile_cache.stats()
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else None
+    return counters
@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+import db
+
+# Per-invocation tracing: every handler call prints one JSON line with the time
+# spent in each phase, the statements it ran and the size of the response.
+# The same file is shipped with every function (auth, users, messages).
+#
+# Phases: connect (pool checkout, including opening a connection), sql (time
+# in cursor.execute), wait (long-poll idle time), serialize (runtime.dumps of
+# the body), explain (slow-query sampler) and app, the remainder: request parsing
+# and row-to-dict conversion.
+
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+TRACE_MAX_STATEMENTS = int(os.environ.get('TRACE_MAX_STATEMENTS', '20'))
+# Statements slower than this are re-run under EXPLAIN ANALYZE; 0 turns the sampler off
+SLOW_QUERY_MS = float(os.environ.get('TRACE_SLOW_QUERY_MS', '0'))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('TRACE_SLOW_QUERY_SAMPLE_RATE', '1'))
+
+# Only plain reads are safe to execute a second time
+SIDE_EFFECTS = ('NEXTVAL(', 'PG_NOTIFY(', 'SETVAL(', 'FOR UPDATE', 'INSERT ', 'UPDATE ', 'DELETE ')
+
+_local = threading.local()
+
+# Extra counters for the log line, e.g. cache hit rates: key -> callable returning a dict
+stats_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+class Trace:
+    def __init__(self, function: str, event: Dict[str, Any]):
+        self.function = function
+        self.method = event.get('httpMethod', 'GET')
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'connect': 0.0, 'sql': 0.0, 'wait': 0.0, 'serialize': 0.0}
+        self.statements: List[Dict[str, Any]] = []
+        self.queries = 0
+        self.rows = 0
+        self.slow: List[Dict[str, Any]] = []
+
+    def add(self, phase: str, ms: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + ms
+
+    def record_query(self, statement: str, ms: float, rows: int) -> None:
+        self.queries += 1
+        self.rows += rows
+        self.add('sql', ms)
+        if len(self.statements) < TRACE_MAX_STATEMENTS:
+            self.statements.append({'sql': statement[:200], 'ms': round(ms, 3), 'rows': rows})
+
+    def finish(self, status: int, body_bytes: int, error: Optional[str] = None) -> Dict[str, Any]:
+        total = (time.perf_counter() - self.started) * 1000
+        phases = {name: round(ms, 3) for name, ms in self.phases.items()}
+        phases['app'] = round(max(total - sum(self.phases.values()), 0.0), 3)
+        record: Dict[str, Any] = {
+            'trace': self.function,
+            'method': self.method,
+            'status': status,
+            'duration_ms': round(total, 3),
+            'phases_ms': phases,
+            'queries': self.queries,
+            'rows': self.rows,
+            'bytes': body_bytes,
+            'statements': self.statements,
+            'pool': db.stats(),
+        }
+        for key, provider in stats_providers.items():
+            record[key] = provider()
+        if self.slow:
+            record['slow_queries'] = self.slow
+        if error:
+            record['error'] = error
+        return record
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    '''Adds the time spent in the block to a phase of the current trace'''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active = current()
+        if active is not None:
+            active.add(name, (time.perf_counter() - started) * 1000)
+
+
+def _normalize(statement: Any) -> str:
+    text = statement if isinstance(statement, str) else statement.decode()
+    return ' '.join(text.split())
+
+
+def _explain(cursor: Any, query: Any, vars: Any) -> Any:
+    '''EXPLAIN ANALYZE on a separate cursor, inside a savepoint so a failure leaves the transaction usable'''
+    with cursor.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as explain:
+        explain.execute('SAVEPOINT trace_explain')
+        try:
+            explain.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + _normalize(query), vars)
+            plan = explain.fetchone()[0][0]
+            explain.execute('RELEASE SAVEPOINT trace_explain')
+            return plan
+        except psycopg2.Error as e:
+            explain.execute('ROLLBACK TO SAVEPOINT trace_explain')
+            return {'error': str(e).strip()}
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    '''Cursor that reports every statement to the trace of the running invocation'''
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        active = current()
+        if active is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            rows = self.rowcount if self.description is not None and self.rowcount > 0 else 0
+            statement = _normalize(query)
+            active.record_query(statement, ms, rows)
+            if (SLOW_QUERY_MS and ms >= SLOW_QUERY_MS and random.random() < SLOW_QUERY_SAMPLE_RATE
+                    and statement.upper().startswith('SELECT')
+                    and not any(marker in statement.upper() for marker in SIDE_EFFECTS)
+                    and self.connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+                with phase('explain'):
+                    plan = _explain(self, query, vars)
+                active.slow.append({'sql': statement, 'ms': round(ms, 3), 'plan': plan})
+
+
+def _on_acquire(ms: float) -> None:
+    active = current()
+    if active is not None:
+        active.add('connect', ms)
+
+
+def _install() -> None:
+    pool = db.get_pool()
+    pool.connect_kwargs.setdefault('cursor_factory', TracedCursor)
+    db.on_acquire = _on_acquire
+
+
+def traced(function: str) -> Callable[[Callable], Callable]:
+    '''Decorator for a function handler: traces each invocation and logs it as one JSON line'''
+    def decorate(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if not TRACE_ENABLED:
+                return handler(event, context)
+            _install()
+            _local.trace = active = Trace(function, event)
+            try:
+                response = handler(event, context)
+            except Exception as e:
+                print(json.dumps(active.finish(500, 0, type(e).__name__)), flush=True)
+                raise
+            finally:
+                _local.trace = None
+            body = response.get('body') or ''
+            print(json.dumps(active.finish(response.get('statusCode', 200), len(body.encode()))), flush=True)
+            return response
+        return wrapper
+    return decorate
@@ -0,0 +1,272 @@
+'''
+Benchmark suite for the auth, users and messages handlers.
+
+Seeds a throwaway database (DATABASE_URL, migrations applied) and replays
+the request mix of the frontend (src/pages/Index.tsx): conversation deltas
+every 3s, the chat list every 5s, a heartbeat every 30s, plus sends,
+mark-read, list, contact and search calls. Handlers are called directly,
+so numbers exclude HTTP and cold starts.
+
+Each endpoint is reported with p50/p95/p99 latency, queries per request,
+rows returned per request and rows scanned per request. Rows scanned come
+from pg_stat_user_tables (seq_tup_read + idx_tup_fetch) deltas. Results go
+to a JSON file, and --compare prints the change between two runs.
+
+    DATABASE_URL=... python backend/tools/bench.py --preset small --label my-change
+    python backend/tools/bench.py --compare bench-results/base.json bench-results/my-change.json
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2.extensions
+
+import harness
+import db
+
+PRESETS = {
+    'small': {'users': 2000, 'messages': 200000, 'contacts': 50},
+    'medium': {'users': 20000, 'messages': 2000000, 'contacts': 200},
+    'full': {'users': 100000, 'messages': 10000000, 'contacts': 1000},
+}
+
+# Requests per minute of one active client, following the frontend timers
+MIX = {
+    'messages.conversation_delta': 20,
+    'messages.chat_list': 12,
+    'users.heartbeat': 2,
+    'messages.send': 2,
+    'messages.mark_read': 2,
+    'messages.conversation_page': 1,
+    'messages.history_page': 1,
+    'users.list': 1,
+    'users.get_contacts': 1,
+    'users.search': 1,
+    'auth.login': 0.5,
+}
+# Users that get a real password hash (at PASSWORD_ITERATIONS) so auth.login measures successful logins
+LOGIN_USERS = 10
+LOGIN_PASSWORD = 'bench'
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    queries = 0
+    rows = 0
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        result = super().execute(query, vars)
+        CountingCursor.queries += 1
+        if self.description is not None and self.rowcount > 0:
+            CountingCursor.rows += self.rowcount
+        return result
+
+
+def rows_scanned() -> Optional[int]:
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_stat_force_next_flush()")
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(SUM(seq_tup_read + COALESCE(idx_tup_fetch, 0)), 0) FROM pg_stat_user_tables")
+                return int(cur.fetchone()[0])
+    except psycopg2.Error:
+        # pg_stat_force_next_flush() needs PostgreSQL 15+
+        return None
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def sample_pairs(count: int, users: int, rng: random.Random) -> List[Tuple[int, int]]:
+    candidates = rng.sample(range(1, users + 1), min(users, count * 4))
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT user_id, partner_id FROM conversations WHERE user_id = ANY(%s) AND user_id <> partner_id",
+                (candidates,)
+            )
+            pairs = cur.fetchall()
+    rng.shuffle(pairs)
+    return pairs[:count]
+
+
+def build_requests(handlers: Dict[str, Any], pairs: List[Tuple[int, int]],
+                   login_users: List[int]) -> Dict[str, Callable[[int], Tuple]]:
+    '''Prepares per-pair state (cursors) and returns a request builder per endpoint'''
+    state: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for user_id, partner_id in pairs:
+        _, page = harness.call(handlers['messages'], 'GET', user_id, {'userId': str(partner_id)})
+        state[(user_id, partner_id)] = {'cursor': page.get('cursor', 0), 'before': page.get('before')}
+
+    def pair(i: int) -> Tuple[int, int, Dict[str, Any]]:
+        user_id, partner_id = pairs[i % len(pairs)]
+        return user_id, partner_id, state[(user_id, partner_id)]
+
+    def history(i: int) -> Tuple:
+        user_id, partner_id, st = pair(i)
+        query = {'userId': str(partner_id)}
+        if st['before']:
+            query['before'] = st['before']
+        return 'messages', 'GET', user_id, query, None
+
+    return {
+        'messages.conversation_delta': lambda i: (
+            'messages', 'GET', pair(i)[0], {'userId': str(pair(i)[1]), 'since': str(pair(i)[2]['cursor'])}, None),
+        'messages.chat_list': lambda i: ('messages', 'GET', pair(i)[0], None, None),
+        'users.heartbeat': lambda i: ('users', 'PUT', pair(i)[0], None, None),
+        'messages.send': lambda i: (
+            'messages', 'POST', pair(i)[0], None, {'receiver_id': pair(i)[1], 'message_text': f'bench {i}'}),
+        'messages.mark_read': lambda i: (
+            'messages', 'POST', pair(i)[1], None, {'action': 'mark_read', 'user_id': pair(i)[0], 'up_to': 2 ** 31 - 1}),
+        'messages.conversation_page': lambda i: ('messages', 'GET', pair(i)[0], {'userId': str(pair(i)[1])}, None),
+        'messages.history_page': history,
+        'users.list': lambda i: ('users', 'GET', pair(i)[0], None, None),
+        'users.get_contacts': lambda i: ('users', 'POST', pair(i)[0], None, {'action': 'get_contacts'}),
+        'users.search': lambda i: ('users', 'GET', pair(i)[0], {'search': 'User 1'}, None),
+        'auth.login': lambda i: ('auth', 'POST', None, None, {
+            'action': 'login', 'username': f'user{login_users[i % len(login_users)]}', 'password': LOGIN_PASSWORD}),
+    }
+
+
+def run_endpoint(handlers: Dict[str, Any], build: Callable[[int], Tuple], count: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    scanned_before = rows_scanned()
+    CountingCursor.queries = 0
+    CountingCursor.rows = 0
+    for i in range(count):
+        function, method, user_id, query, body = build(i)
+        started = time.perf_counter()
+        status, _ = harness.call(handlers[function], method, user_id, query, body)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    queries, rows = CountingCursor.queries, CountingCursor.rows
+    scanned_after = rows_scanned()
+    result = {
+        'requests': count,
+        'statuses': statuses,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'queries_per_request': round(queries / count, 2),
+        'rows_returned_per_request': round(rows / count, 2),
+        'rows_scanned_per_request': None,
+    }
+    if scanned_before is not None and scanned_after is not None:
+        # The two stats probes run between the snapshots; their own reads are negligible
+        result['rows_scanned_per_request'] = round((scanned_after - scanned_before) / count, 2)
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=harness.BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path: str, new_path: str) -> int:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'endpoint':32} {'p95 old':>9} {'p95 new':>9} {'change':>8} {'queries':>9} {'scanned':>12}")
+    for name, result in new['endpoints'].items():
+        before = old['endpoints'].get(name)
+        if not before:
+            print(f'{name:32} {"-":>9} {result["p95_ms"]:>9} {"new":>8}')
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        queries = f"{before['queries_per_request']}->{result['queries_per_request']}"
+        scanned = f"{before['rows_scanned_per_request']}->{result['rows_scanned_per_request']}"
+        print(f'{name:32} {before["p95_ms"]:>9} {result["p95_ms"]:>9} {change:>+7.1f}% {queries:>9} {scanned:>12}')
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--contacts', type=int)
+    parser.add_argument('--requests', type=int, default=2000, help='total requests across the mix')
+    parser.add_argument('--pairs', type=int, default=200, help='conversations sampled for the replay')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default=None, help='result file name, defaults to the git commit')
+    parser.add_argument('--out-dir', default='bench-results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    scale = dict(PRESETS[args.preset])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    db.get_pool().connect_kwargs = {'cursor_factory': CountingCursor}
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            started = time.monotonic()
+            if harness.seed(cur, scale['users'], scale['messages'], scale['contacts']):
+                print(f'Seeded {scale} in {time.monotonic() - started:.1f}s')
+            cur.execute("SELECT COUNT(*) FROM users")
+            scale['users'] = cur.fetchone()[0]
+            cur.execute("SHOW server_version")
+            server_version = cur.fetchone()[0]
+
+    rng = random.Random(args.seed)
+    handlers = {name: harness.load_handler(name) for name in harness.FUNCTIONS}
+    pairs = sample_pairs(args.pairs, scale['users'], rng)
+    if not pairs:
+        print('No conversations to replay')
+        return 1
+    login_users = sorted({user_id for user_id, _ in pairs})[:LOGIN_USERS]
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            harness.set_password(cur, login_users, LOGIN_PASSWORD)
+    builders = build_requests(handlers, pairs, login_users)
+
+    total_weight = sum(MIX.values())
+    endpoints = {}
+    for name, weight in MIX.items():
+        count = max(10, round(args.requests * weight / total_weight))
+        endpoints[name] = run_endpoint(handlers, builders[name], count)
+        print(f"{name:32} p50 {endpoints[name]['p50_ms']:>8} ms  p95 {endpoints[name]['p95_ms']:>8} ms  "
+              f"p99 {endpoints[name]['p99_ms']:>8} ms  q/req {endpoints[name]['queries_per_request']:>5}  "
+              f"scanned/req {endpoints[name]['rows_scanned_per_request']}")
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'label': args.label,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'server_version': server_version,
+        'scale': scale,
+        'requests': args.requests,
+        'pairs': len(pairs),
+        'pool': db.stats(),
+        'endpoints': endpoints,
+    }
+    os.makedirs(args.out_dir, exist_ok=True)
+    path = os.path.join(args.out_dir, f'{args.label or commit or "bench"}.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
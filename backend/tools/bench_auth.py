@@ -0,0 +1,105 @@
+'''
+Cost of authentication per request and per login.
+
+Measures session token issue/verify and request authentication through
+runtime.Request (token vs the legacy X-User-Id header). It also measures
+the password KDF at the configured work factor (PASSWORD_ITERATIONS) and at
+the --iterations alternatives, which bounds login throughput per instance.
+With --logins N it also runs N logins through the auth handler against
+DATABASE_URL.
+
+    python backend/tools/bench_auth.py [--iterations 100000 260000 600000] [--logins 20] [--out result.json]
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+# Sessions must be enabled before session.py is imported
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+
+import harness  # noqa: E402
+import passwords  # noqa: E402
+import runtime  # noqa: E402
+import session  # noqa: E402
+
+
+def per_call_us(fn: Callable[[], Any], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def tokens(repeat: int) -> Dict[str, float]:
+    token = session.issue(12345)
+    tampered = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+    token_event = {'httpMethod': 'GET', 'headers': {'X-Session-Token': token}}
+    legacy_event = {'httpMethod': 'GET', 'headers': {'X-User-Id': '12345'}}
+    assert session.verify(token) == 12345 and session.verify(tampered) is None
+    return {
+        'issue_us': round(per_call_us(lambda: session.issue(12345), repeat), 2),
+        'verify_us': round(per_call_us(lambda: session.verify(token), repeat), 2),
+        'verify_rejected_us': round(per_call_us(lambda: session.verify(tampered), repeat), 2),
+        'request_token_us': round(per_call_us(lambda: runtime.Request(token_event).user_id, repeat), 2),
+        'legacy_header_parse_us': round(per_call_us(lambda: int(legacy_event['headers']['X-User-Id']), repeat), 2),
+    }
+
+
+def kdf(iterations: List[int], samples: int) -> List[Dict[str, Any]]:
+    results = []
+    for count in sorted(set(iterations + [passwords.ITERATIONS])):
+        stored = passwords.hash_password('correct horse', count)
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            passwords.verify_password('correct horse', stored)
+            timings.append((time.perf_counter() - started) * 1000)
+        ms = statistics.median(timings)
+        results.append({'iterations': count, 'configured': count == passwords.ITERATIONS,
+                        'verify_ms': round(ms, 2), 'logins_per_second_per_core': round(1000 / ms, 1)})
+    return results
+
+
+def logins(count: int) -> Dict[str, Any]:
+    auth = harness.load_handler('auth')
+    username = f'bench_auth_{os.getpid()}'
+    harness.call(auth, 'POST', body={'action': 'register', 'username': username, 'password': 'pw',
+                                      'phone': f'+7999{os.getpid() % 10000000:07d}'})
+    timings = {'ok': [], 'wrong_password': [], 'unknown_user': []}
+    for _ in range(count):
+        for case, name, password in (('ok', username, 'pw'), ('wrong_password', username, 'nope'),
+                                     ('unknown_user', username + '_missing', 'pw')):
+            started = time.perf_counter()
+            harness.call(auth, 'POST', body={'action': 'login', 'username': name, 'password': password})
+            timings[case].append((time.perf_counter() - started) * 1000)
+    return {case: round(statistics.median(values), 2) for case, values in timings.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, nargs='*', default=[100000, 260000, 600000])
+    parser.add_argument('--samples', type=int, default=5, help='KDF timings per work factor')
+    parser.add_argument('--repeat', type=int, default=100000, help='token operations per measurement')
+    parser.add_argument('--logins', type=int, default=0, help='logins through the handler (needs DATABASE_URL)')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {'tokens': tokens(args.repeat), 'kdf': kdf(args.iterations, args.samples)}
+    print(json.dumps(results['tokens']))
+    for row in results['kdf']:
+        print(json.dumps(row))
+    if args.logins:
+        results['login_ms_p50'] = logins(args.logins)
+        print(json.dumps(results['login_ms_p50']))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+'''
+Compares fixed-interval polling with long polling of the messages function.
+
+A sender thread posts messages to user 2 at random intervals while a receiver
+either polls the conversation delta every --interval seconds (what the
+frontend used to do) or long-polls it with wait=--wait. Reports handler
+invocations and delivery latency, measured from the send call to the
+receiver seeing the message, for both modes.
+
+    DATABASE_URL=... python backend/tools/bench_longpoll.py [--messages 10] [--out result.json]
+'''
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Set
+
+import harness
+import db
+
+SENDER_ID = 1
+RECEIVER_ID = 2
+
+
+def run(messages_module: Any, mode: str, count: int, interval: float, wait: float, rng: random.Random) -> Dict[str, Any]:
+    _, page = harness.call(messages_module, 'GET', RECEIVER_ID, {'userId': str(SENDER_ID), 'limit': '1'})
+    cursor = page['cursor']
+    sent_at: Dict[str, float] = {}
+    delivered: Set[str] = set()
+    latencies: List[float] = []
+    invocations = 0
+    empty = 0
+
+    def send() -> None:
+        for i in range(count):
+            time.sleep(rng.uniform(0.5, 4.0))
+            text = f'bench {mode} {i}'
+            sent_at[text] = time.monotonic()
+            harness.call(messages_module, 'POST', SENDER_ID, body={'receiver_id': RECEIVER_ID, 'message_text': text})
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    seen = 0
+    while seen < count:
+        query = {'userId': str(SENDER_ID), 'since': str(cursor)}
+        if mode == 'longpoll':
+            query['wait'] = str(wait)
+        _, body = harness.call(messages_module, 'GET', RECEIVER_ID, query)
+        invocations += 1
+        now = time.monotonic()
+        cursor = body['cursor']
+        if not body['messages'] and not body['deleted']:
+            empty += 1
+        for message in body['messages']:
+            text = message['message_text']
+            if text in sent_at and text not in delivered:
+                delivered.add(text)
+                latencies.append((now - sent_at[text]) * 1000)
+                seen += 1
+        if mode == 'poll' or body.get('retry_after'):
+            time.sleep(body.get('retry_after') or interval)
+    sender.join()
+
+    return {
+        'mode': mode,
+        'messages': count,
+        'invocations': invocations,
+        'empty_invocations': empty,
+        'latency_ms_p50': round(statistics.median(latencies), 1),
+        'latency_ms_max': round(max(latencies), 1),
+        'latency_ms_mean': round(statistics.mean(latencies), 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=3.0, help='polling interval, seconds')
+    parser.add_argument('--wait', type=float, default=20.0, help='long-poll wait, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            harness.seed(cur, users=10, messages=0, contacts_per_user=2)
+
+    messages_module = harness.load_handler('messages')
+    results = [
+        run(messages_module, mode, args.messages, args.interval, args.wait, random.Random(args.seed))
+        for mode in ('poll', 'longpoll')
+    ]
+    for result in results:
+        print(json.dumps(result))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
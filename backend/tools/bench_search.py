@@ -0,0 +1,132 @@
+'''
+Latency of full-text message search (GET /messages?search=...).
+
+Seeds an empty database (DATABASE_URL) with --messages messages whose texts
+are drawn from a mixed Russian/English vocabulary, frequent words first.
+It then runs each query class --queries times as random users, fetching
+the first page and, where there is one, the next page through the keyset
+cursor. Reports p50/p95/p99 per class, the average page fill, and the
+indexes in the plan of the search statement: the GIN index on search_vector
+(BitmapAnd with the sender/receiver indexes for busy users) or just the
+sender/receiver indexes when the caller has few messages.
+
+    DATABASE_URL=... python backend/tools/bench_search.py [--messages 2000000] [--users 20000] [--out result.json]
+'''
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Any, Dict, List, Set
+
+import harness
+import db
+
+VOCABULARY = [
+    'привет', 'hello', 'сообщения', 'message', 'сегодня', 'today', 'встреча', 'meeting', 'работа',
+    'working', 'завтра', 'tomorrow', 'документы', 'documents', 'звонок', 'call', 'проект', 'project',
+    'отправил', 'sent', 'фотографии', 'photos', 'вечером', 'evening', 'договорились', 'agreed',
+    'билеты', 'tickets', 'поездка', 'travel', 'отчёт', 'report', 'собака', 'dogs', 'погода', 'weather',
+    'праздник', 'holiday', 'подарок', 'present', 'ресторан', 'restaurant', 'футбол', 'football',
+    'концерт', 'concert', 'отпуск', 'vacation', 'квартира', 'apartment', 'ремонт', 'repairs',
+    'библиотека', 'library', 'университет', 'university', 'экзамены', 'exams', 'велосипед', 'bicycle',
+]
+
+# Query class -> search text. Inflections differ from the seeded forms on purpose.
+QUERIES = {
+    'frequent word': 'привет',
+    'rare word': 'велосипеды',
+    'stemmed ru': 'сообщение',
+    'stemmed en': 'messages',
+    'two words': 'работа documents',
+    'phrase': '"hello сообщения"',
+    'negation': 'meeting -завтра',
+    'no match': 'квазар',
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 2)
+
+
+def plan_indexes(plan: Dict[str, Any]) -> Set[str]:
+    found = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        found |= plan_indexes(child)
+    return found
+
+
+def indexes_used(messages_module: Any, user_id: int, query: str) -> List[str]:
+    '''Indexes in the plan of the search statement (per partition for messages)'''
+    params = {'query': query, 'user_id': user_id, 'after_rank': None, 'after_id': None, 'limit': 21}
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('EXPLAIN (FORMAT JSON) ' + messages_module.SEARCH_SQL, params)
+            return sorted(plan_indexes(cur.fetchone()[0][0]['Plan']))
+
+
+def run(messages_module: Any, name: str, query: str, users: int, count: int, limit: int,
+        rng: random.Random) -> Dict[str, Any]:
+    first: List[float] = []
+    following: List[float] = []
+    fill: List[int] = []
+    for _ in range(count):
+        user_id = rng.randint(1, users)
+        started = time.perf_counter()
+        status, body = harness.call(messages_module, 'GET', user_id, {'search': query, 'limit': str(limit)})
+        first.append((time.perf_counter() - started) * 1000)
+        assert status == 200, body
+        fill.append(len(body['messages']))
+        if body['after']:
+            started = time.perf_counter()
+            harness.call(messages_module, 'GET', user_id, {'search': query, 'limit': str(limit), 'after': body['after']})
+            following.append((time.perf_counter() - started) * 1000)
+    result = {
+        'query': name,
+        'text': query,
+        'first_page_ms_p50': percentile(first, 0.5),
+        'first_page_ms_p95': percentile(first, 0.95),
+        'first_page_ms_p99': percentile(first, 0.99),
+        'avg_results': round(sum(fill) / len(fill), 1),
+        'indexes': indexes_used(messages_module, 1, query),
+    }
+    if following:
+        result['next_page_ms_p50'] = percentile(following, 0.5)
+        result['next_page_ms_p95'] = percentile(following, 0.95)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--contacts', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=50, help='runs per query class')
+    parser.add_argument('--limit', type=int, default=20, help='page size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            started = time.perf_counter()
+            if harness.seed(cur, args.users, args.messages, args.contacts, vocabulary=VOCABULARY):
+                print(f'Seeded {args.users} users, {args.messages} messages in {time.perf_counter() - started:.0f}s')
+            cur.execute("SELECT count(*) FROM messages")
+            total = cur.fetchone()[0]
+
+    messages_module = harness.load_handler('messages')
+    rng = random.Random(args.seed)
+    results = [run(messages_module, name, query, args.users, args.queries, args.limit, rng)
+               for name, query in QUERIES.items()]
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'messages': total, 'users': args.users, 'results': results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
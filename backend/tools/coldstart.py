@@ -0,0 +1,76 @@
+'''
+Import and cold-start timings of the function handlers.
+
+Each sample runs in a fresh interpreter: import of backend/<name>/index.py,
+the first invocation (which opens the pool connection) and a second, warm
+invocation. Needs a seeded database (DATABASE_URL), see harness.seed.
+
+    DATABASE_URL=... python backend/tools/coldstart.py [--runs 15] [--out result.json]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+import harness
+import db
+
+EVENTS = {
+    'auth': {'httpMethod': 'POST', 'headers': {},
+             'body': json.dumps({'action': 'login', 'username': 'user1', 'password': 'x'})},
+    'users': {'httpMethod': 'GET', 'headers': {'X-User-Id': '1'}, 'queryStringParameters': None},
+    'messages': {'httpMethod': 'GET', 'headers': {'X-User-Id': '1'}, 'queryStringParameters': None},
+}
+
+SAMPLE = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {path!r})
+import index
+imported = time.perf_counter()
+index.handler({event!r}, None)
+first = time.perf_counter()
+index.handler({event!r}, None)
+warm = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'first_ms': (first - imported) * 1000,
+                   'warm_ms': (warm - first) * 1000}}))
+'''
+
+
+def sample(name: str) -> Dict[str, float]:
+    code = SAMPLE.format(path=os.path.join(harness.BACKEND_DIR, name), event=EVENTS[name])
+    env = dict(os.environ, TRACE_ENABLED='0')
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            harness.seed(cur, users=1000, messages=20000, contacts_per_user=20)
+
+    results: Dict[str, Any] = {}
+    for name in harness.FUNCTIONS:
+        samples: List[Dict[str, float]] = [sample(name) for _ in range(args.runs)]
+        # Medians, plus minimums which are steadier on a noisy machine
+        results[name] = {}
+        for key in ('import_ms', 'first_ms', 'warm_ms'):
+            results[name][key] = round(statistics.median(s[key] for s in samples), 2)
+            results[name][key.replace('_ms', '_min_ms')] = round(min(s[key] for s in samples), 2)
+        print(json.dumps(dict(results[name], function=name)))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
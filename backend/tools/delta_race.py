@@ -0,0 +1,167 @@
+'''
+Conversation deltas against writers that commit out of order.
+
+Each case pauses one writer (a send, a delete or a send_batch) inside its
+transaction after it has taken a message revision: right before it updates
+the conversations summary, where a slow network round trip or a row lock held
+by another request would stall it. While it is paused, a second write to the
+same conversation (a send or a send_batch) goes through the handler and the
+reader polls the delta (GET ?userId=&since=). Then the paused writer goes on
+and commits, and the reader polls again from the cursor it got. Every message
+and deletion must show up in one of the two deltas; a cursor that ran past
+the paused writer's revision loses it for good. Exits non-zero on any loss.
+
+    DATABASE_URL=... python backend/tools/delta_race.py
+'''
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+import psycopg2
+
+import harness
+import db
+
+READER = 1
+PARTNER = 2
+# Third user a batch also writes to
+OTHER = 3
+# How long the concurrent writer gets to finish before the reader polls
+SETTLE_SECONDS = 0.3
+# conversations functions a writer calls once its revision is taken
+PAUSE_POINTS = ('record_message', 'record_messages', 'record_deletion')
+
+Write = Tuple[str, Set[int]]
+
+
+class Pause:
+    '''Stops the owning thread at the first pause point until released'''
+
+    def __init__(self, conversations: Any):
+        self.owner = None
+        self.reached = threading.Event()
+        self.released = threading.Event()
+        for name in PAUSE_POINTS:
+            setattr(conversations, name, self._wrap(getattr(conversations, name)))
+
+    def _wrap(self, original: Callable[..., Any]) -> Callable[..., Any]:
+        def paused(*args: Any, **kwargs: Any) -> Any:
+            if threading.current_thread() is self.owner and not self.reached.is_set():
+                self.reached.set()
+                self.released.wait()
+            return original(*args, **kwargs)
+        return paused
+
+    def arm(self, owner: threading.Thread) -> None:
+        self.owner = owner
+        self.reached.clear()
+        self.released.clear()
+
+
+def delta(messages_module: Any, since: int) -> Tuple[int, Set[int], Set[int]]:
+    _, body = harness.call(messages_module, 'GET', READER, {'userId': str(PARTNER), 'since': str(since)})
+    return body['cursor'], {m['id'] for m in body['messages']}, set(body['deleted'])
+
+
+def run_case(messages_module: Any, pause: Pause, name: str,
+             held: Callable[[Any], Write], concurrent: Callable[[], Write]) -> List[str]:
+    '''held(cur) is paused inside its own transaction while concurrent() runs'''
+    _, body = harness.call(messages_module, 'GET', READER, {'userId': str(PARTNER), 'limit': '1'})
+    cursor = body['cursor']
+    results: Dict[str, Write] = {}
+
+    def held_writer() -> None:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        try:
+            with conn.cursor() as cur:
+                results['held'] = held(cur)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def concurrent_writer() -> None:
+        results['concurrent'] = concurrent()
+
+    first = threading.Thread(target=held_writer)
+    second = threading.Thread(target=concurrent_writer)
+    pause.arm(first)
+    first.start()
+    if not pause.reached.wait(5):
+        pause.released.set()
+        first.join()
+        return [f'{name}: the held writer never reached a pause point']
+    second.start()
+    second.join(SETTLE_SECONDS)
+    cursor, seen, deleted = delta(messages_module, cursor)
+    pause.released.set()
+    first.join()
+    second.join()
+
+    cursor, seen_after, deleted_after = delta(messages_module, cursor)
+    seen |= seen_after
+    deleted |= deleted_after
+    problems = []
+    for source, (kind, ids) in results.items():
+        missing = ids - (seen if kind == 'message' else deleted)
+        if missing:
+            problems.append(f'{name}: {kind} {sorted(missing)} from the {source} writer never reached the delta')
+    if len(results) != 2:
+        problems.append(f'{name}: a writer failed')
+    return problems
+
+
+def cases(messages_module: Any) -> List[Tuple[str, Callable[[Any], Write], Callable[[], Write]]]:
+    def send(sender_id: int, receiver_id: int, text: str) -> int:
+        _, body = harness.call(messages_module, 'POST', sender_id, body={'receiver_id': receiver_id, 'message_text': text})
+        return body['message']['id']
+
+    def send_held(cur: Any) -> Write:
+        message_id, _ = messages_module.store_message(cur, PARTNER, READER, 'held')
+        return 'message', {message_id}
+
+    def send_concurrent() -> Write:
+        return 'message', {send(READER, PARTNER, 'concurrent')}
+
+    def batch_held(cur: Any) -> Write:
+        ids, _ = messages_module.store_batch(cur, PARTNER, [(READER, 'held 1'), (OTHER, 'held'), (READER, 'held 2')])
+        return 'message', {ids[0], ids[2]}
+
+    def batch_concurrent() -> Write:
+        _, body = harness.call(messages_module, 'POST', READER, body={
+            'action': 'send_batch', 'message_text': 'concurrent', 'receiver_ids': [OTHER, PARTNER]
+        })
+        return 'message', {m['id'] for m in body['messages'] if m['receiver_id'] == PARTNER}
+
+    def delete_held(cur: Any) -> Write:
+        messages_module.remove_message(cur, PARTNER, victim)
+        return 'deleted', {victim}
+
+    victim = send(PARTNER, READER, 'to delete')
+    return [
+        ('send vs send', send_held, send_concurrent),
+        ('delete vs send', delete_held, send_concurrent),
+        ('batch vs send', batch_held, send_concurrent),
+        ('send vs batch', send_held, batch_concurrent),
+    ]
+
+
+def main() -> int:
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            harness.seed(cur, users=10, messages=100, contacts_per_user=2)
+
+    messages_module = harness.load_handler('messages')
+    pause = Pause(messages_module.conversations)
+    problems: List[str] = []
+    for name, held, concurrent in cases(messages_module):
+        found = run_case(messages_module, pause, name, held, concurrent)
+        print(f"{'FAIL' if found else 'ok  '}  {name}")
+        problems.extend(found)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
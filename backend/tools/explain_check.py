@@ -0,0 +1,129 @@
+'''
+EXPLAIN regression check for the handler queries.
+
+Runs every handler branch against a seeded throwaway database (DATABASE_URL,
+migrations applied) and EXPLAINs each statement the handlers send. Fails if
+any plan contains a sequential scan on one of the application tables, or
+if a scenario is answered with an error (it would skip the statements it is
+there to check).
+
+Seq scans are disabled for the session, so the planner only falls back to
+one when no index can serve the query. That keeps the check independent of
+the seed size.
+
+    DATABASE_URL=... python backend/tools/explain_check.py [--users N] [--messages N] [--contacts N]
+'''
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+import psycopg2.extensions
+
+import harness
+import db
+
+WATCHED_TABLES = {'users', 'messages', 'messages_archive', 'contacts', 'conversations', 'presence'}
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+findings: List[Tuple[str, str, str]] = []
+current_scenario = ''
+
+
+def watched(relation: str) -> bool:
+    # Monthly partitions (messages_y2024m01) and messages_default count as messages
+    return relation in WATCHED_TABLES or relation.startswith(('messages_y', 'messages_default'))
+
+
+def seq_scans(plan: Dict[str, Any]) -> List[str]:
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and watched(plan.get('Relation Name', '')):
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+class ExplainingCursor(psycopg2.extensions.cursor):
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        statement = query if isinstance(query, str) else query.decode()
+        if statement.lstrip().upper().startswith(EXPLAINABLE):
+            with self.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as explain:
+                explain.execute('EXPLAIN (FORMAT JSON) ' + statement, vars)
+                plan = explain.fetchone()[0][0]['Plan']
+            for table in seq_scans(plan):
+                findings.append((current_scenario, table, ' '.join(statement.split())))
+        return super().execute(query, vars)
+
+
+def scenarios(auth: Any, users: Any, messages: Any, own_message_id: int) -> List[Tuple[str, Any, Dict[str, Any]]]:
+    '''own_message_id is a live message sent by user 1, so the delete goes through every statement'''
+    return [
+        ('auth login', auth, {'method': 'POST', 'body': {'action': 'login', 'username': 'user1', 'password': 'x'}}),
+        ('auth register', auth, {'method': 'POST', 'body': {
+            'action': 'register', 'username': 'explain_check', 'password': 'x', 'phone': '+79990000000'}}),
+        ('users list', users, {'method': 'GET', 'user_id': 1}),
+        ('users search', users, {'method': 'GET', 'user_id': 1, 'query': {'search': 'User 1'}}),
+        ('users heartbeat', users, {'method': 'PUT', 'user_id': 1}),
+        ('users add_contacts', users, {'method': 'POST', 'user_id': 1, 'body': {
+            'action': 'add_contacts', 'contacts': ['+79000000002', '+79000000003']}}),
+        ('users get_contacts', users, {'method': 'POST', 'user_id': 1, 'body': {'action': 'get_contacts'}}),
+        ('users delete_contact', users, {'method': 'POST', 'user_id': 1, 'body': {
+            'action': 'delete_contact', 'contact_id': 1}}),
+        ('messages chat list', messages, {'method': 'GET', 'user_id': 1}),
+        ('messages conversation', messages, {'method': 'GET', 'user_id': 1, 'query': {'userId': '2'}}),
+        ('messages search', messages, {'method': 'GET', 'user_id': 1, 'query': {'search': 'message'}}),
+        ('messages delta', messages, {'method': 'GET', 'user_id': 1, 'query': {'userId': '2', 'since': '0'}}),
+        ('messages mark_read', messages, {'method': 'POST', 'user_id': 1, 'body': {
+            'action': 'mark_read', 'user_id': 2, 'up_to': 1000000}}),
+        ('messages send', messages, {'method': 'POST', 'user_id': 1, 'body': {
+            'receiver_id': 2, 'message_text': 'explain check'}}),
+        ('messages delete', messages, {'method': 'DELETE', 'user_id': 1, 'query': {'messageId': str(own_message_id)}}),
+    ]
+
+
+def main() -> int:
+    global current_scenario
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--contacts', type=int, default=50)
+    args = parser.parse_args()
+
+    pool = db.get_pool()
+    pool.connect_kwargs = {'cursor_factory': ExplainingCursor, 'options': '-c enable_seqscan=off'}
+
+    with db.connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            if harness.seed(cur, args.users, args.messages, args.contacts):
+                print(f'Seeded {args.users} users, {args.messages} messages')
+            # A real hash at another work factor, so the login succeeds and also rehashes
+            harness.set_password(cur, [1], 'x', iterations=1000)
+            cur.execute("SELECT min(id) FROM messages WHERE sender_id = 1 AND deleted_at IS NULL")
+            own_message_id = cur.fetchone()[0]
+
+    auth, users, messages = (harness.load_handler(name) for name in harness.FUNCTIONS)
+    failed = []
+    for name, module, request in scenarios(auth, users, messages, own_message_id):
+        current_scenario = name
+        status, _ = harness.call(module, request['method'], request.get('user_id'),
+                                 request.get('query'), request.get('body'))
+        print(f'{status}  {name}')
+        if status >= 400:
+            failed.append(name)
+
+    if failed:
+        print('\nScenarios that ended early: ' + ', '.join(failed))
+        return 1
+
+    if findings:
+        print('\nSequential scans found:')
+        for scenario, table, statement in findings:
+            print(json.dumps({'scenario': scenario, 'table': table, 'statement': statement}, ensure_ascii=False))
+        return 1
+    print('\nNo sequential scans on ' + ', '.join(sorted(WATCHED_TABLES)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
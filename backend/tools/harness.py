@@ -0,0 +1,122 @@
+import importlib.util
+import json
+import os
+import sys
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Helpers for running the function handlers locally against a throwaway
+# database (DATABASE_URL) with db_migrations already applied.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ('auth', 'users', 'messages')
+
+# The tools print their own reports; set TRACE_ENABLED=1 to also get the per-invocation log lines
+os.environ.setdefault('TRACE_ENABLED', '0')
+# Requests carry X-User-Id (and a session token once SESSION_SECRET is set)
+os.environ.setdefault('TRUST_USER_ID_HEADER', '1')
+
+for name in FUNCTIONS:
+    path = os.path.join(BACKEND_DIR, name)
+    if path not in sys.path:
+        sys.path.append(path)
+
+import conversations  # noqa: E402  (backend/messages)
+import passwords  # noqa: E402  (backend/auth)
+import session  # noqa: E402
+
+
+def load_handler(name: str) -> Any:
+    '''Imports backend/<name>/index.py under a unique module name'''
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(BACKEND_DIR, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def call(handler_module: Any, method: str, user_id: Optional[int] = None,
+         query: Optional[Dict[str, str]] = None, body: Optional[Dict[str, Any]] = None) -> Tuple[int, Any]:
+    headers = {'X-User-Id': str(user_id)} if user_id is not None else {}
+    if user_id is not None and session.enabled():
+        headers['X-Session-Token'] = session.issue(user_id)
+    event: Dict[str, Any] = {'httpMethod': method, 'headers': headers, 'queryStringParameters': query}
+    if body is not None:
+        event['body'] = json.dumps(body)
+    response = handler_module.handler(event, None)
+    try:
+        return response['statusCode'], json.loads(response['body'])
+    except ValueError:
+        return response['statusCode'], response['body']
+
+
+def seed(cur: Any, users: int, messages: int, contacts_per_user: int,
+         vocabulary: Optional[Sequence[str]] = None) -> bool:
+    '''
+    Fills an empty database with synthetic users, contacts and messages.
+    With a vocabulary, message texts are three of its words, earlier words
+    much more frequent than later ones, plus the message number.
+    Returns False without touching anything if users already exist.
+    '''
+    cur.execute("SELECT EXISTS (SELECT 1 FROM users)")
+    if cur.fetchone()[0]:
+        return False
+
+    cur.execute(
+        """
+        INSERT INTO users (username, password_hash, display_name, phone)
+        SELECT 'user' || g, 'x', 'User ' || g, '+7900' || lpad(g::text, 7, '0')
+        FROM generate_series(1, %s) g
+        """,
+        (users,)
+    )
+    cur.execute(
+        """
+        INSERT INTO contacts (user_id, contact_phone, contact_user_id)
+        SELECT u, '+7900' || lpad(c::text, 7, '0'), c
+        FROM (
+            SELECT u, 1 + (u + k * 7919) %% %s AS c
+            FROM generate_series(1, %s) u, generate_series(1, %s) k
+        ) pairs
+        ON CONFLICT DO NOTHING
+        """,
+        (users, users, contacts_per_user)
+    )
+    # Each user talks to a handful of partners; message i is i seconds old
+    cur.execute(
+        """
+        SELECT create_messages_partition(m::date)
+        FROM generate_series(date_trunc('month', LOCALTIMESTAMP - make_interval(secs => %s)),
+                             date_trunc('month', LOCALTIMESTAMP), INTERVAL '1 month') m
+        """,
+        (messages,)
+    )
+    text = "'message ' || g"
+    params: Tuple = ()
+    if vocabulary:
+        # Word k of message g: hash of (g, k) mapped onto the vocabulary with a cubic skew
+        word = "(%s::text[])[1 + floor({n} * power((hashint4(g * 3 + {k}) & 1048575) / 1048576.0, 3))::int]"
+        text = " || ' ' || ".join(word.format(n=len(vocabulary), k=k) for k in range(3)) + " || ' ' || g"
+        params = (list(vocabulary),) * 3
+    cur.execute(
+        f"""
+        INSERT INTO messages (sender_id, receiver_id, message_text, is_read, created_at)
+        SELECT s, 1 + (s + (g %% 5) * 7919) %% %s, {text}, g > 20,
+               CURRENT_TIMESTAMP - make_interval(secs => g)
+        FROM (SELECT g, 1 + (g * 31) %% %s AS s FROM generate_series(1, %s) g) m
+        """,
+        (users,) + params + (users, messages)
+    )
+    conversations.rebuild(cur)
+    cur.execute("ANALYZE")
+    return True
+
+
+def set_password(cur: Any, user_ids: Sequence[int], password: str, iterations: Optional[int] = None) -> None:
+    '''
+    Gives seeded users (whose password_hash is a placeholder) a real salted hash
+    of password, at the configured work factor unless iterations says otherwise
+    '''
+    for user_id in user_ids:
+        cur.execute(
+            "UPDATE users SET password_hash = %s WHERE id = %s",
+            (passwords.hash_password(password, iterations or passwords.ITERATIONS), user_id)
+        )
@@ -0,0 +1,106 @@
+'''
+Parallel signups against the auth handler.
+
+Fires --rounds rounds of concurrent register calls at DATABASE_URL. Each round
+has --workers callers that share a username, --workers that share a phone
+(written differently each time, e.g. 8XXX and +7XXX) and one contact waiting
+for that phone. Exactly one caller per group must succeed, the others must
+get the matching 400, and the waiting contact must end up linked to the
+winner. Exits non-zero on any violation.
+
+    DATABASE_URL=... python backend/tools/register_race.py [--rounds 20] [--workers 8]
+'''
+import argparse
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+# Keep the KDF cheap so the inserts, not the hashing, line up
+os.environ.setdefault('PASSWORD_ITERATIONS', '1000')
+os.environ.setdefault('DB_POOL_SIZE', '16')
+
+import harness  # noqa: E402
+import db  # noqa: E402
+
+
+def register_all(auth: Any, bodies: List[Dict[str, Any]]) -> List[Tuple[int, Any]]:
+    barrier = threading.Barrier(len(bodies))
+
+    def one(body: Dict[str, Any]) -> Tuple[int, Any]:
+        barrier.wait()
+        try:
+            return harness.call(auth, 'POST', body=dict(body, action='register', password='pw'))
+        except Exception as e:
+            # What the platform would turn into a 500
+            return 500, repr(e)
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        return list(pool.map(one, bodies))
+
+
+def check(results: List[Tuple[int, Any]], conflict: str) -> List[str]:
+    problems = []
+    winners = [body for status, body in results if status == 200]
+    losers = [body for status, body in results if status != 200]
+    if len(winners) != 1:
+        problems.append(f'{len(winners)} successful signups, expected 1')
+    for body in losers:
+        if not isinstance(body, dict) or body.get('error') != conflict:
+            problems.append(f'unexpected response {body!r}')
+    return problems
+
+
+def round_trip(auth: Any, workers: int) -> List[str]:
+    tag = uuid.uuid4().hex[:10]
+    local = str(int(tag, 16) % 10 ** 10).zfill(10)
+    phone = '+7' + local
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM users ORDER BY id LIMIT 1")
+            owner = cur.fetchone()[0]
+            cur.execute("INSERT INTO contacts (user_id, contact_phone) VALUES (%s, %s)", (owner, phone))
+
+    same_name = register_all(auth, [
+        {'username': f'race_{tag}', 'phone': f'+7{str(int(local) + i + 1).zfill(10)[-10:]}'} for i in range(workers)
+    ])
+    same_phone = register_all(auth, [
+        {'username': f'race_{tag}_{i}', 'phone': ('8' + local) if i % 2 else phone} for i in range(workers)
+    ])
+    problems = check(same_name, 'Username already exists') + check(same_phone, 'Phone number already registered')
+
+    winner = next((body['user']['id'] for status, body in same_phone if status == 200), None)
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT contact_user_id FROM contacts WHERE user_id = %s AND contact_phone = %s", (owner, phone))
+            linked = cur.fetchone()[0]
+    if winner is not None and linked != winner:
+        problems.append(f'contact linked to {linked}, expected {winner}')
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            harness.seed(cur, users=10, messages=0, contacts_per_user=2)
+
+    auth = harness.load_handler('auth')
+    failures = 0
+    for number in range(args.rounds):
+        problems = round_trip(auth, args.workers)
+        for problem in problems:
+            print(f'round {number}: {problem}')
+        failures += bool(problems)
+    print(f'{args.rounds - failures}/{args.rounds} rounds consistent ({args.workers} concurrent signups per group)')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
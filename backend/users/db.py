@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+# The same file is shipped with every function (auth, users, messages):
+# each function directory is deployed on its own, so keep the copies identical.
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+# Called with the checkout time in ms after every connection() checkout (set by tracing.py)
+on_acquire: Optional[Callable[[float], None]] = None
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Bounded pool of psycopg2 connections that lives at module level, so warm
+    invocations of a function reuse open sockets instead of reconnecting
+    '''
+
+    def __init__(self, dsn: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 healthcheck_after: float = HEALTHCHECK_AFTER, **connect_kwargs: Any):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self.connect_kwargs = connect_kwargs
+        self._idle: List[Tuple[Any, float]] = []
+        self._opened = 0
+        self._cond = threading.Condition()
+        self._stats: Dict[str, float] = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'timeouts': 0,
+            'wait_ms': 0.0,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return dict(self._stats, opened=self._opened, idle=len(self._idle))
+
+    def _connect(self) -> Any:
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    def _is_alive(self, conn: Any) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self) -> Any:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn: Optional[Any] = None
+        last_used = 0.0
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._stats['hits'] += 1
+                    break
+                if self._opened < self.size:
+                    self._opened += 1
+                    self._stats['misses'] += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available within {self.timeout}s')
+                self._cond.wait(remaining)
+            self._stats['wait_ms'] += (time.monotonic() - started) * 1000
+
+        try:
+            if conn is None:
+                return self._connect()
+            if conn.closed or (time.monotonic() - last_used > self.healthcheck_after and not self._is_alive(conn)):
+                self._close(conn)
+                with self._cond:
+                    self._stats['reconnects'] += 1
+                return self._connect()
+            return conn
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: Any, broken: bool = False) -> None:
+        if not broken and not conn.closed:
+            status = conn.info.transaction_status
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._opened -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        '''
+        Checks a connection out for one request. Like `with psycopg2.connect()`,
+        the transaction is committed on success and rolled back on error.
+        '''
+        started = time.monotonic()
+        conn = self.acquire()
+        if on_acquire is not None:
+            on_acquire((time.monotonic() - started) * 1000)
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'))
+    return _pool
+
+
+def connection() -> Any:
+    return get_pool().connection()
+
+
+def stats() -> Dict[str, float]:
+    '''Pool counters for this instance: hits, misses, reconnects, timeouts, wait_ms'''
+    return get_pool().stats()
@@ -1,178 +1,174 @@
-import json
 import os
-import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+import db
+import presence
+import runtime
+import tracing
+from cache import TTLCache
+from phone import normalize_phone
+
+# add_contacts writes the address book in multi-row statements of this many phones
+CONTACTS_CHUNK_SIZE = 1000
+MAX_CONTACTS_PER_REQUEST = 10000
+
+USER_KEYS = ('id', 'name', 'avatar', 'status')
+
+# Resolved contact lists per user; CONTACTS_CACHE_TTL=0 disables caching
+contacts_cache = TTLCache(
+    maxsize=int(os.environ.get('CONTACTS_CACHE_SIZE', '1000')),
+    ttl=float(os.environ.get('CONTACTS_CACHE_TTL', '10'))
+)
+
+def load_contacts(user_id: int) -> List[Tuple]:
     '''
-    Business: Get list of users from contacts and manage online status
-    Args: event with httpMethod, queryStringParameters, headers with X-User-Id
-    Returns: HTTP response with users list from contacts
+    Contacts of user_id as (contact id, phone, user id, display name, avatar, status),
+    sorted by name with unresolved phones last
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    
-    if method == 'PUT' and user_id:
-        dsn = os.environ.get('DATABASE_URL')
-        with psycopg2.connect(dsn) as conn:
+    rows = contacts_cache.get(user_id)
+    if rows is None:
+        with db.connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    "UPDATE users SET is_online = true, last_seen = CURRENT_TIMESTAMP WHERE id = %s",
-                    (int(user_id),)
+                    """
+                    SELECT c.id, c.contact_phone, u.id, u.display_name, u.avatar, u.status
+                    FROM contacts c
+                    LEFT JOIN users u ON u.id = c.contact_user_id
+                    WHERE c.user_id = %s
+                    ORDER BY u.display_name NULLS LAST, c.contact_phone
+                    """,
+                    (user_id,)
                 )
-                conn.commit()
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'status': 'online'})
-        }
-    
-    if method == 'POST' and user_id:
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
-        
-        dsn = os.environ.get('DATABASE_URL')
-        
-        if action == 'add_contacts':
-            contacts = body_data.get('contacts', [])
-            with psycopg2.connect(dsn) as conn:
-                with conn.cursor() as cur:
-                    for phone in contacts:
-                        cur.execute(
-                            "INSERT INTO contacts (user_id, contact_phone) VALUES (%s, %s) ON CONFLICT (user_id, contact_phone) DO NOTHING",
-                            (int(user_id), phone)
-                        )
-                    conn.commit()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'status': 'contacts synced'})
-            }
-        
-        elif action == 'get_contacts':
-            with psycopg2.connect(dsn) as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT c.id, c.contact_phone, u.id, u.display_name, u.avatar, u.is_online
-                        FROM contacts c
-                        LEFT JOIN users u ON u.phone = c.contact_phone
-                        WHERE c.user_id = %s
-                        ORDER BY u.display_name NULLS LAST, c.contact_phone
-                        """,
-                        (int(user_id),)
-                    )
-                    contacts_list = []
-                    for row in cur.fetchall():
-                        contact = {
-                            'id': row[0],
-                            'phone': row[1],
-                        }
-                        if row[2]:
-                            contact['user_id'] = row[2]
-                            contact['name'] = row[3]
-                            contact['avatar'] = row[4]
-                            contact['online'] = row[5]
-                        contacts_list.append(contact)
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'contacts': contacts_list})
-                    }
-        
-        elif action == 'delete_contact':
-            contact_id = body_data.get('contact_id')
-            with psycopg2.connect(dsn) as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "DELETE FROM contacts WHERE id = %s AND user_id = %s",
-                        (int(contact_id), int(user_id))
-                    )
-                    conn.commit()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'status': 'contact deleted'})
-            }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid action'})
-        }
-    
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Unauthorized'})
-        }
-    
-    query_params = event.get('queryStringParameters') or {}
-    search = query_params.get('search', '').strip()
+                rows = cur.fetchall()
+        contacts_cache.set(user_id, rows)
+    return rows
+
+def heartbeat(request: runtime.Request) -> runtime.Response:
+    presence.heartbeat(request.user_id)
+    return runtime.ok({'status': 'online'})
+
+def add_contacts(request: runtime.Request) -> runtime.Response:
+    contacts = request.body.get('contacts', [])
+    if len(contacts) > MAX_CONTACTS_PER_REQUEST:
+        return runtime.error(413, f'At most {MAX_CONTACTS_PER_REQUEST} contacts per request')
     
-    dsn = os.environ.get('DATABASE_URL')
+    phones = []
+    seen = set()
+    invalid = 0
+    for raw_phone in contacts:
+        phone = normalize_phone(str(raw_phone))
+        if not phone:
+            invalid += 1
+        elif phone not in seen:
+            seen.add(phone)
+            phones.append(phone)
     
-    with psycopg2.connect(dsn) as conn:
+    inserted = 0
+    matched = 0
+    with db.connection() as conn:
         with conn.cursor() as cur:
-            if search:
+            for start in range(0, len(phones), CONTACTS_CHUNK_SIZE):
                 cur.execute(
                     """
-                    SELECT DISTINCT u.id, u.display_name, u.avatar, u.status, u.is_online, u.last_seen 
-                    FROM users u
-                    INNER JOIN contacts c ON u.phone = c.contact_phone
-                    WHERE c.user_id = %s 
-                    AND (u.display_name ILIKE %s OR u.username ILIKE %s)
-                    ORDER BY u.display_name
+                    WITH input AS (
+                        SELECT DISTINCT ON (p.phone) p.phone, u.id AS contact_user_id
+                        FROM unnest(%s::varchar[]) AS p(phone)
+                        LEFT JOIN users u ON u.phone = p.phone
+                        ORDER BY p.phone, u.id
+                    ), added AS (
+                        INSERT INTO contacts (user_id, contact_phone, contact_user_id)
+                        SELECT %s, phone, contact_user_id FROM input
+                        ON CONFLICT (user_id, contact_phone) DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT
+                        (SELECT COUNT(*) FROM added),
+                        (SELECT COUNT(contact_user_id) FROM input)
                     """,
-                    (int(user_id), f'%{search}%', f'%{search}%')
+                    (phones[start:start + CONTACTS_CHUNK_SIZE], request.user_id)
                 )
-            else:
+                chunk_inserted, chunk_matched = cur.fetchone()
+                inserted += chunk_inserted
+                matched += chunk_matched
+    contacts_cache.invalidate(request.user_id)
+    return runtime.ok({
+        'status': 'contacts synced',
+        'received': len(contacts),
+        'inserted': inserted,
+        'duplicates': len(contacts) - invalid - inserted,
+        'invalid': invalid,
+        'matched_users': matched
+    })
+
+def get_contacts(request: runtime.Request) -> runtime.Response:
+    rows = load_contacts(request.user_id)
+    online = presence.online_ids(row[2] for row in rows if row[2])
+    contacts_list = []
+    for row in rows:
+        contact = {
+            'id': row[0],
+            'phone': row[1],
+        }
+        if row[2]:
+            contact['user_id'] = row[2]
+            contact['name'] = row[3]
+            contact['avatar'] = row[4]
+            contact['online'] = row[2] in online
+        contacts_list.append(contact)
+    return runtime.ok({'contacts': contacts_list})
+
+def delete_contact(request: runtime.Request) -> runtime.Response:
+    contact_id = request.body.get('contact_id')
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM contacts WHERE id = %s AND user_id = %s",
+                (int(contact_id), request.user_id)
+            )
+    contacts_cache.invalidate(request.user_id)
+    return runtime.ok({'status': 'contact deleted'})
+
+def list_users(request: runtime.Request) -> runtime.Response:
+    user_id = request.user_id
+    search = request.query.get('search', '').strip()
+    
+    if search:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT DISTINCT u.id, u.display_name, u.avatar, u.status, u.is_online, u.last_seen 
-                    FROM users u
-                    INNER JOIN contacts c ON u.phone = c.contact_phone
+                    SELECT u.id, u.display_name, u.avatar, u.status
+                    FROM contacts c
+                    INNER JOIN users u ON u.id = c.contact_user_id
                     WHERE c.user_id = %s
+                    AND (u.display_name ILIKE %s OR u.username ILIKE %s)
                     ORDER BY u.display_name
                     """,
-                    (int(user_id),)
+                    (user_id, f'%{search}%', f'%{search}%')
                 )
-            
-            users = []
-            for row in cur.fetchall():
-                users.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'avatar': row[2],
-                    'status': row[3],
-                    'online': row[4] if row[4] is not None else False
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'users': users})
-            }
\ No newline at end of file
+                rows = cur.fetchall()
+    else:
+        rows = [row[2:] for row in load_contacts(user_id) if row[2]]
+    
+    online = presence.online_ids(row[0] for row in rows)
+    users = [dict(zip(USER_KEYS, row), online=row[0] in online) for row in rows]
+    return runtime.ok({'users': users})
+
+tracing.stats_providers['contacts_cache'] = contacts_cache.stats
+
+router = runtime.Router({
+    ('GET', None): list_users,
+    ('PUT', None): heartbeat,
+    ('POST', 'add_contacts'): add_contacts,
+    ('POST', 'get_contacts'): get_contacts,
+    ('POST', 'delete_contact'): delete_contact,
+}, unauthorized='Unauthorized')
+
+@tracing.traced('users')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Get list of users from contacts and manage online status
+    Args: event with httpMethod, queryStringParameters, headers with X-Session-Token
+    Returns: HTTP response with users list from contacts
+    '''
+    return router.dispatch(event)
\ No newline at end of file
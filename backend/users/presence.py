@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Set, Tuple
+
+import db
+
+# Write-behind presence. Heartbeats are buffered per instance and written to
+# the presence table in batches; a user counts as online while their
+# last_seen is younger than ONLINE_TTL.
+
+ONLINE_TTL = float(os.environ.get('PRESENCE_ONLINE_TTL', '90'))
+# A user's heartbeat is written at most once per FLUSH_INTERVAL by this instance.
+# Clients beat every 30s, so stored last_seen lags by at most ~FLUSH_INTERVAL + 30s < ONLINE_TTL.
+FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '45'))
+MAX_PENDING = 500
+
+_lock = threading.Lock()
+_pending: Dict[int, datetime] = {}
+_flushed_at: Dict[int, float] = {}
+
+
+def heartbeat(user_id: int) -> bool:
+    '''
+    Records that user_id is alive. Flushes all pending heartbeats of this
+    instance in one statement when this user's stored last_seen is due for
+    a refresh. Returns True if a write happened.
+    '''
+    now = time.monotonic()
+    with _lock:
+        _pending[user_id] = datetime.now(timezone.utc)
+        if now - _flushed_at.get(user_id, float('-inf')) < FLUSH_INTERVAL and len(_pending) < MAX_PENDING:
+            return False
+        batch = sorted(_pending.items())
+        _pending.clear()
+        for pending_id, _ in batch:
+            _flushed_at[pending_id] = now
+        if len(_flushed_at) > 10 * MAX_PENDING:
+            for known_id, flushed in list(_flushed_at.items()):
+                if now - flushed >= FLUSH_INTERVAL:
+                    del _flushed_at[known_id]
+    try:
+        flush(batch)
+    except Exception:
+        with _lock:
+            for pending_id, seen in batch:
+                _pending.setdefault(pending_id, seen)
+                _flushed_at.pop(pending_id, None)
+        raise
+    return True
+
+
+def flush(batch: List[Tuple[int, datetime]]) -> None:
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO presence (user_id, last_seen)
+                SELECT * FROM unnest(%s::int[], %s::timestamptz[])
+                ON CONFLICT (user_id) DO UPDATE SET last_seen = GREATEST(presence.last_seen, EXCLUDED.last_seen)
+                """,
+                ([user_id for user_id, _ in batch], [seen for _, seen in batch])
+            )
+
+
+def online_ids(user_ids: Iterable[int]) -> Set[int]:
+    '''Which of user_ids are online, in one indexed lookup that never touches users rows'''
+    ids = list(set(user_ids))
+    if not ids:
+        return set()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ONLINE_TTL)
+    with _lock:
+        online = {user_id for user_id in ids if _pending.get(user_id, cutoff) > cutoff}
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT user_id FROM presence WHERE user_id = ANY(%s) AND last_seen > %s",
+                (ids, cutoff)
+            )
+            online.update(row[0] for row in cur.fetchall())
+    return online
@@ -0,0 +1,5 @@
+-- Every insert, edit and deletion of a message takes a new revision so clients can fetch deltas
+CREATE SEQUENCE IF NOT EXISTS messages_revision_seq;
+
+ALTER TABLE messages ADD COLUMN revision BIGINT NOT NULL DEFAULT nextval('messages_revision_seq');
+ALTER TABLE messages ADD COLUMN deleted_at TIMESTAMP;
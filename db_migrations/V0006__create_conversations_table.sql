@@ -0,0 +1,30 @@
+-- One summary row per (user, partner) for the chat list, maintained by the messages function
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    partner_id INTEGER NOT NULL REFERENCES users(id),
+    last_message_id INTEGER NOT NULL,
+    last_message_text TEXT NOT NULL,
+    last_message_at TIMESTAMP NOT NULL,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, partner_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversations_user_last ON conversations(user_id, last_message_at DESC);
+
+-- Backfill from existing messages (same query as `python conversations.py` in backend/messages)
+WITH pairs AS (
+    SELECT sender_id AS user_id, receiver_id AS partner_id, id, message_text, created_at, 0 AS unread
+    FROM messages
+    WHERE deleted_at IS NULL
+    UNION ALL
+    SELECT receiver_id, sender_id, id, message_text, created_at, CASE WHEN is_read THEN 0 ELSE 1 END
+    FROM messages
+    WHERE deleted_at IS NULL AND receiver_id <> sender_id
+)
+INSERT INTO conversations (user_id, partner_id, last_message_id, last_message_text, last_message_at, unread_count)
+SELECT DISTINCT ON (user_id, partner_id)
+    user_id, partner_id, id, message_text, created_at,
+    SUM(unread) OVER (PARTITION BY user_id, partner_id)
+FROM pairs
+ORDER BY user_id, partner_id, created_at DESC, id DESC
+ON CONFLICT (user_id, partner_id) DO NOTHING;
@@ -0,0 +1,15 @@
+-- Conversation pages and the latest-message lookup: pair predicate ordered by (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_messages_pair_created ON messages(sender_id, receiver_id, created_at DESC, id DESC) WHERE deleted_at IS NULL;
+
+-- Delta fetches: pair predicate with revision > cursor
+CREATE INDEX IF NOT EXISTS idx_messages_pair_revision ON messages(sender_id, receiver_id, revision);
+
+-- Marking a conversation read only touches unread rows
+CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(receiver_id, sender_id) WHERE is_read = FALSE AND deleted_at IS NULL;
+
+-- Registration phone check and the contacts -> users join
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone);
+
+-- Covered by idx_messages_pair_created / idx_messages_pair_revision; nothing filters on created_at alone
+DROP INDEX IF EXISTS idx_messages_sender;
+DROP INDEX IF EXISTS idx_messages_created;
@@ -0,0 +1,22 @@
+-- Same rules as normalize_phone() in backend/users/phone.py and backend/auth/phone.py
+CREATE OR REPLACE FUNCTION normalize_phone(raw TEXT) RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN d ~ '^8[0-9]{10}$' THEN '+7' || substr(d, 2)
+        WHEN d ~ '^[0-9]{10}$' THEN '+7' || d
+        WHEN length(d) BETWEEN 5 AND 15 THEN '+' || d
+    END
+    FROM (SELECT regexp_replace(raw, '[^0-9]', '', 'g') AS d) s
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE users SET phone = normalize_phone(phone)
+WHERE normalize_phone(phone) IS NOT NULL AND normalize_phone(phone) <> phone;
+
+-- Contacts that become equal after normalization collapse into the oldest row
+DELETE FROM contacts c
+USING contacts keep
+WHERE c.user_id = keep.user_id
+AND c.id > keep.id
+AND COALESCE(normalize_phone(c.contact_phone), c.contact_phone) = COALESCE(normalize_phone(keep.contact_phone), keep.contact_phone);
+
+UPDATE contacts SET contact_phone = normalize_phone(contact_phone)
+WHERE normalize_phone(contact_phone) IS NOT NULL AND normalize_phone(contact_phone) <> contact_phone;
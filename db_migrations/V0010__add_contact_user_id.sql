@@ -0,0 +1,11 @@
+-- Contacts remember which user their phone resolved to, so lists join on ids instead of phone strings
+ALTER TABLE contacts ADD COLUMN contact_user_id INTEGER REFERENCES users(id);
+
+UPDATE contacts c SET contact_user_id = u.id
+FROM users u
+WHERE u.phone = c.contact_phone;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_user_resolved ON contacts(user_id, contact_user_id) WHERE contact_user_id IS NOT NULL;
+
+-- Registration links pending contacts by phone
+CREATE INDEX IF NOT EXISTS idx_contacts_phone_unresolved ON contacts(contact_phone) WHERE contact_user_id IS NULL;
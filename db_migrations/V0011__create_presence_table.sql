@@ -0,0 +1,6 @@
+-- Heartbeats land here instead of on users rows. Online state is derived from last_seen by the users function.
+-- Unlogged: presence is rebuilt by the next round of heartbeats if the table is lost after a crash.
+CREATE UNLOGGED TABLE IF NOT EXISTS presence (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    last_seen TIMESTAMPTZ NOT NULL
+) WITH (fillfactor = 50);
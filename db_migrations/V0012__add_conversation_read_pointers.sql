@@ -0,0 +1,19 @@
+-- Reading moves a per-conversation high-water mark instead of flagging every message row.
+-- messages.is_read is no longer written.
+ALTER TABLE conversations ADD COLUMN last_read_id INTEGER NOT NULL DEFAULT 0;
+
+UPDATE conversations c SET last_read_id = COALESCE((
+    SELECT MAX(m.id) FROM messages m
+    WHERE m.sender_id = c.partner_id AND m.receiver_id = c.user_id AND m.is_read
+), 0);
+
+UPDATE conversations c SET unread_count = (
+    SELECT COUNT(*) FROM messages m
+    WHERE m.sender_id = c.partner_id AND m.receiver_id = c.user_id AND m.sender_id <> m.receiver_id
+    AND m.id > c.last_read_id AND m.deleted_at IS NULL
+);
+
+-- Unread counts are recounted from the pointer: messages of a pair after a given id
+CREATE INDEX IF NOT EXISTS idx_messages_pair_id ON messages(sender_id, receiver_id, id) WHERE deleted_at IS NULL;
+
+DROP INDEX IF EXISTS idx_messages_unread;
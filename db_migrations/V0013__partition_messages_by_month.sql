@@ -0,0 +1,84 @@
+-- Messages move to monthly range partitions on created_at. Rows outside every monthly
+-- partition land in messages_default until create_messages_partition() picks them up.
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    sender_id INTEGER REFERENCES users(id),
+    receiver_id INTEGER REFERENCES users(id),
+    message_text TEXT NOT NULL,
+    is_read BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    revision BIGINT NOT NULL DEFAULT nextval('messages_revision_seq'),
+    deleted_at TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+-- Creates the partition for the month containing `month` (messages_yYYYYmMM) unless it exists,
+-- moving rows of that month out of messages_default first. Used by backend/messages/archive.py.
+CREATE OR REPLACE FUNCTION create_messages_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    lower_bound TIMESTAMP := date_trunc('month', month);
+    upper_bound TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    partition_name TEXT := 'messages_' || to_char(lower_bound, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM messages_default WHERE created_at >= %L AND created_at < %L RETURNING *)
+         INSERT INTO %I SELECT * FROM moved',
+        lower_bound, upper_bound, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+
+-- One partition per month of existing history, plus the current and next two months
+SELECT create_messages_partition(m::date)
+FROM generate_series(
+    date_trunc('month', LEAST(COALESCE((SELECT MIN(created_at) FROM messages_legacy), CURRENT_TIMESTAMP), CURRENT_TIMESTAMP)),
+    date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '2 months',
+    INTERVAL '1 month'
+) m;
+
+INSERT INTO messages (id, sender_id, receiver_id, message_text, is_read, created_at, revision, deleted_at)
+SELECT id, sender_id, receiver_id, message_text, is_read, COALESCE(created_at, CURRENT_TIMESTAMP), revision, deleted_at
+FROM messages_legacy;
+
+DROP TABLE messages_legacy;
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+-- Same indexes as before, created once the rows are in (cascade to every partition)
+CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id);
+CREATE INDEX IF NOT EXISTS idx_messages_pair_created ON messages(sender_id, receiver_id, created_at DESC, id DESC) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_pair_revision ON messages(sender_id, receiver_id, revision);
+CREATE INDEX IF NOT EXISTS idx_messages_pair_id ON messages(sender_id, receiver_id, id) WHERE deleted_at IS NULL;
+
+-- Cold partitions are folded in here by archive.py: live messages only, stored in pair order
+CREATE TABLE IF NOT EXISTS messages_archive (
+    id INTEGER NOT NULL,
+    sender_id INTEGER,
+    receiver_id INTEGER,
+    message_text TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_archive_pair_created ON messages_archive(sender_id, receiver_id, created_at DESC, id DESC);
+
+-- Full history for reads that reach past the partitions
+CREATE OR REPLACE VIEW messages_history AS
+SELECT id, sender_id, receiver_id, message_text, created_at, deleted_at FROM messages
+UNION ALL
+SELECT id, sender_id, receiver_id, message_text, created_at, NULL::timestamp FROM messages_archive;
+
+ANALYZE messages;
@@ -0,0 +1,22 @@
+-- Registration relies on unique indexes instead of checking first: username is already
+-- UNIQUE (users_username_key), phones get a unique index on their normalized form.
+
+-- Phones stored since V0009 should already be normalized; catch any that are not
+UPDATE users SET phone = normalize_phone(phone)
+WHERE normalize_phone(phone) IS NOT NULL AND normalize_phone(phone) <> phone;
+
+-- Contacts resolved to a later duplicate point at the oldest account with that phone instead
+UPDATE contacts c SET contact_user_id = keep.id
+FROM users dup, users keep
+WHERE c.contact_user_id = dup.id
+AND normalize_phone(keep.phone) = normalize_phone(dup.phone)
+AND keep.id = (SELECT MIN(id) FROM users u WHERE normalize_phone(u.phone) = normalize_phone(dup.phone))
+AND dup.id <> keep.id;
+
+-- The oldest account keeps a duplicated phone, later ones lose it
+UPDATE users dup SET phone = NULL
+FROM users keep
+WHERE normalize_phone(keep.phone) = normalize_phone(dup.phone)
+AND keep.id < dup.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_phone_normalized ON users(normalize_phone(phone));
@@ -0,0 +1,54 @@
+-- Full-text search over message text. The russian configuration stems Cyrillic words with the
+-- Russian and Latin ones with the English stemmer, so one vector covers both languages. Images
+-- are sent as data: URLs and are not indexed; very long texts are indexed by their first 100k chars.
+ALTER TABLE messages ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    CASE WHEN message_text LIKE 'data:%' THEN NULL
+    ELSE to_tsvector('russian', left(message_text, 100000))
+    END
+) STORED;
+
+ALTER TABLE messages_archive ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    CASE WHEN message_text LIKE 'data:%' THEN NULL
+    ELSE to_tsvector('russian', left(message_text, 100000))
+    END
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_messages_archive_search ON messages_archive USING gin (search_vector);
+
+-- New partitions take the generated column over; rows move with explicit columns since
+-- generated ones cannot be inserted
+CREATE OR REPLACE FUNCTION create_messages_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    lower_bound TIMESTAMP := date_trunc('month', month);
+    upper_bound TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    partition_name TEXT := 'messages_' || to_char(lower_bound, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (
+             DELETE FROM messages_default WHERE created_at >= %L AND created_at < %L
+             RETURNING id, sender_id, receiver_id, message_text, is_read, created_at, revision, deleted_at
+         )
+         INSERT INTO %I (id, sender_id, receiver_id, message_text, is_read, created_at, revision, deleted_at)
+         SELECT * FROM moved',
+        lower_bound, upper_bound, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE VIEW messages_history AS
+SELECT id, sender_id, receiver_id, message_text, created_at, deleted_at, search_vector FROM messages
+UNION ALL
+SELECT id, sender_id, receiver_id, message_text, created_at, NULL::timestamp, search_vector FROM messages_archive;
+
+ANALYZE messages;
+ANALYZE messages_archive;
@@ -0,0 +1,17 @@
+-- The messages function caches display name, avatar and status per user; changes to
+-- them are announced on the profile_changed channel (payload: user id) so instances
+-- can drop the entry instead of waiting for the TTL.
+CREATE OR REPLACE FUNCTION notify_profile_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('profile_changed', NEW.id::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_profile_changed
+AFTER UPDATE OF display_name, avatar, status ON users
+FOR EACH ROW
+WHEN (OLD.display_name IS DISTINCT FROM NEW.display_name
+      OR OLD.avatar IS DISTINCT FROM NEW.avatar
+      OR OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION notify_profile_changed();
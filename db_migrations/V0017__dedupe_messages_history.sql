@@ -0,0 +1,9 @@
+-- archive.py copies a cold partition into messages_archive while the partition is still
+-- attached and only detaches it afterwards, so for a while the same message is in both
+-- tables. The history view prefers the partitioned copy until the partition is gone.
+CREATE OR REPLACE VIEW messages_history AS
+SELECT id, sender_id, receiver_id, message_text, created_at, deleted_at, search_vector FROM messages
+UNION ALL
+SELECT a.id, a.sender_id, a.receiver_id, a.message_text, a.created_at, NULL::timestamp, a.search_vector
+FROM messages_archive a
+WHERE NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = a.id AND m.created_at = a.created_at);
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import Icon from '@/components/ui/icon';
 import { Input } from '@/components/ui/input';
 import { Button } from '@/components/ui/button';
@@ -15,6 +15,15 @@ const API = {
   messages: 'https://functions.poehali.dev/62e8ab46-bd47-4349-a92a-883ed3105455',
 };
 
+// Seconds the messages function may hold a request open waiting for news
+const LONG_POLL_WAIT = 20;
+const POLL_RETRY_SECONDS = 3;
+
+// Address books are uploaded in slices so one request stays well under the server limit
+const CONTACTS_UPLOAD_CHUNK = 2000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
 type Tab = 'messages' | 'search' | 'profile' | 'settings' | 'chat';
 
 interface User {
@@ -23,8 +32,15 @@ interface User {
   display_name: string;
   avatar: string;
   status: string;
+  token?: string | null;
 }
 
+// Session token issued at login; X-User-Id is only honoured by deployments that opt in with TRUST_USER_ID_HEADER
+const authHeaders = (user: User): Record<string, string> =>
+  user.token
+    ? { 'X-User-Id': String(user.id), 'X-Session-Token': user.token }
+    : { 'X-User-Id': String(user.id) };
+
 interface Chat {
   id: number;
   name: string;
@@ -41,10 +57,17 @@ interface Message {
   receiver_id: number;
   message_text: string;
   created_at: string;
-  sender_name: string;
-  sender_avatar: string;
 }
 
+// Messages and chats carry user ids; names and avatars come once per response in `profiles`
+interface Profile {
+  display_name: string;
+  avatar: string;
+  status: string;
+}
+
+type Profiles = Record<number, Profile>;
+
 export default function Index() {
   const [currentUser, setCurrentUser] = useState<User | null>(null);
   const [isLogin, setIsLogin] = useState(true);
@@ -63,6 +86,10 @@ export default function Index() {
   const [users, setUsers] = useState<any[]>([]);
   const [selectedChat, setSelectedChat] = useState<number | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const messagesCursor = useRef<{ chatId: number; cursor: number } | null>(null);
+  const openChat = useRef<number | null>(null);
+  const chatsCursor = useRef<string | null>(null);
   const [newMessage, setNewMessage] = useState('');
   const [selectedImage, setSelectedImage] = useState<string | null>(null);
   const [showEmojiPicker, setShowEmojiPicker] = useState(false);
@@ -96,20 +123,40 @@ export default function Index() {
 
   useEffect(() => {
     if (currentUser && selectedChat) {
-      loadMessages(selectedChat);
-      const interval = setInterval(() => {
-        loadMessages(selectedChat);
-      }, 3000);
-      return () => clearInterval(interval);
+      messagesCursor.current = null;
+      openChat.current = selectedChat;
+      setMessages([]);
+      setOlderCursor(null);
+      let active = true;
+      const poll = async () => {
+        await loadMessages(selectedChat);
+        while (active) {
+          const retryAfter = await loadMessages(selectedChat, LONG_POLL_WAIT);
+          if (retryAfter) await sleep(retryAfter * 1000);
+        }
+      };
+      poll();
+      return () => {
+        active = false;
+        openChat.current = null;
+      };
     }
   }, [currentUser, selectedChat]);
 
   useEffect(() => {
     if (currentUser && activeTab === 'messages') {
-      const interval = setInterval(() => {
-        loadChats();
-      }, 5000);
-      return () => clearInterval(interval);
+      let active = true;
+      const poll = async () => {
+        await loadChats();
+        while (active) {
+          const retryAfter = await loadChats(LONG_POLL_WAIT);
+          if (retryAfter) await sleep(retryAfter * 1000);
+        }
+      };
+      poll();
+      return () => {
+        active = false;
+      };
     }
   }, [currentUser, activeTab]);
 
@@ -148,23 +195,43 @@ export default function Index() {
         setError(data.error || 'Ошибка');
         return;
       }
-      setCurrentUser(data.user);
-      localStorage.setItem('currentUser', JSON.stringify(data.user));
+      const user = { ...data.user, token: data.token };
+      setCurrentUser(user);
+      localStorage.setItem('currentUser', JSON.stringify(user));
     } catch (err) {
       setError('Ошибка соединения');
     }
   };
 
-  const loadChats = async () => {
-    if (!currentUser) return;
+  const loadChats = async (wait = 0): Promise<number> => {
+    if (!currentUser) return 0;
+    const known = chatsCursor.current;
     try {
-      const res = await fetch(API.messages, {
-        headers: { 'X-User-Id': String(currentUser.id) },
+      const url = wait && known !== null
+        ? `${API.messages}?since=${known}&wait=${wait}`
+        : API.messages;
+      const res = await fetch(url, {
+        headers: authHeaders(currentUser),
       });
+      if (res.status === 401) {
+        logout();
+        return 0;
+      }
       const data = await res.json();
-      setChats(data.chats || []);
+      if (!data.unchanged) {
+        const profiles: Profiles = data.profiles || {};
+        setChats((data.chats || []).map((chat: Omit<Chat, 'name' | 'avatar' | 'status'>) => ({
+          ...chat,
+          name: profiles[chat.id]?.display_name ?? '',
+          avatar: profiles[chat.id]?.avatar ?? '👤',
+          status: profiles[chat.id]?.status ?? '',
+        })));
+      }
+      chatsCursor.current = data.cursor ?? chatsCursor.current;
+      return data.retry_after || 0;
     } catch (err) {
       console.error(err);
+      return POLL_RETRY_SECONDS;
     }
   };
 
@@ -175,7 +242,7 @@ export default function Index() {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': String(currentUser.id),
+          ...authHeaders(currentUser),
         },
       });
     } catch (err) {
@@ -186,14 +253,19 @@ export default function Index() {
   const syncContacts = async (contacts: string[]) => {
     if (!currentUser) return;
     try {
-      await fetch(API.users, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-User-Id': String(currentUser.id),
-        },
-        body: JSON.stringify({ action: 'add_contacts', contacts }),
-      });
+      for (let start = 0; start < contacts.length; start += CONTACTS_UPLOAD_CHUNK) {
+        await fetch(API.users, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            ...authHeaders(currentUser),
+          },
+          body: JSON.stringify({
+            action: 'add_contacts',
+            contacts: contacts.slice(start, start + CONTACTS_UPLOAD_CHUNK),
+          }),
+        });
+      }
       loadUsers();
       loadMyContacts();
     } catch (err) {
@@ -208,7 +280,7 @@ export default function Index() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': String(currentUser.id),
+          ...authHeaders(currentUser),
         },
         body: JSON.stringify({ action: 'get_contacts' }),
       });
@@ -226,7 +298,7 @@ export default function Index() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': String(currentUser.id),
+          ...authHeaders(currentUser),
         },
         body: JSON.stringify({ action: 'delete_contact', contact_id: contactId }),
       });
@@ -242,7 +314,7 @@ export default function Index() {
     try {
       const url = search ? `${API.users}?search=${encodeURIComponent(search)}` : API.users;
       const res = await fetch(url, {
-        headers: { 'X-User-Id': String(currentUser.id) },
+        headers: authHeaders(currentUser),
       });
       const data = await res.json();
       setUsers(data.users.filter((u: any) => u.id !== currentUser.id));
@@ -251,14 +323,72 @@ export default function Index() {
     }
   };
 
-  const loadMessages = async (userId: number) => {
+  const loadMessages = async (userId: number, wait = 0): Promise<number> => {
+    if (!currentUser) return 0;
+    const known = messagesCursor.current?.chatId === userId ? messagesCursor.current.cursor : null;
+    try {
+      const url = known === null
+        ? `${API.messages}?userId=${userId}`
+        : `${API.messages}?userId=${userId}&since=${known}${wait ? `&wait=${wait}` : ''}`;
+      const res = await fetch(url, {
+        headers: authHeaders(currentUser),
+      });
+      const data = await res.json();
+      if (openChat.current !== userId) return 0;
+      if (known === null) {
+        setMessages(data.messages || []);
+        setOlderCursor(data.before || null);
+      } else if (data.messages?.length || data.deleted?.length) {
+        const deleted = new Set<number>(data.deleted || []);
+        const changed = new Map<number, Message>((data.messages || []).map((m: Message) => [m.id, m]));
+        setMessages((prev) => {
+          const merged = prev
+            .filter((m) => !deleted.has(m.id) && !changed.has(m.id))
+            .concat(Array.from(changed.values()));
+          return merged.sort((a, b) => a.created_at.localeCompare(b.created_at) || a.id - b.id);
+        });
+      }
+      const previous = messagesCursor.current?.chatId === userId ? messagesCursor.current.cursor : 0;
+      messagesCursor.current = { chatId: userId, cursor: Math.max(previous, data.cursor ?? known ?? 0) };
+      const lastIncoming = Math.max(0, ...(data.messages || [])
+        .filter((m: Message) => m.sender_id === userId)
+        .map((m: Message) => m.id));
+      if (lastIncoming > (data.read_id ?? 0)) {
+        markRead(userId, lastIncoming);
+      }
+      return data.retry_after || 0;
+    } catch (err) {
+      console.error(err);
+      return POLL_RETRY_SECONDS;
+    }
+  };
+
+  const markRead = async (userId: number, upTo: number) => {
     if (!currentUser) return;
     try {
-      const res = await fetch(`${API.messages}?userId=${userId}`, {
-        headers: { 'X-User-Id': String(currentUser.id) },
+      await fetch(API.messages, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          ...authHeaders(currentUser),
+        },
+        body: JSON.stringify({ action: 'mark_read', user_id: userId, up_to: upTo }),
+      });
+      loadChats();
+    } catch (err) {
+      console.error(err);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!currentUser || !selectedChat || !olderCursor) return;
+    try {
+      const res = await fetch(`${API.messages}?userId=${selectedChat}&before=${encodeURIComponent(olderCursor)}`, {
+        headers: authHeaders(currentUser),
       });
       const data = await res.json();
-      setMessages(data.messages || []);
+      setMessages((prev) => [...(data.messages || []), ...prev]);
+      setOlderCursor(data.before || null);
     } catch (err) {
       console.error(err);
     }
@@ -274,7 +404,7 @@ export default function Index() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': String(currentUser.id),
+          ...authHeaders(currentUser),
         },
         body: JSON.stringify({
           receiver_id: selectedChat,
@@ -297,7 +427,7 @@ export default function Index() {
       await fetch(`${API.messages}?messageId=${messageId}`, {
         method: 'DELETE',
         headers: {
-          'X-User-Id': String(currentUser.id),
+          ...authHeaders(currentUser),
         },
       });
       loadMessages(selectedChat);
@@ -563,6 +693,13 @@ export default function Index() {
                 </div>
 
                 <div className="flex-1 overflow-y-auto p-4 space-y-4">
+                  {olderCursor && (
+                    <div className="flex justify-center">
+                      <Button variant="ghost" size="sm" onClick={loadOlderMessages}>
+                        Загрузить ранние сообщения
+                      </Button>
+                    </div>
+                  )}
                   {messages.map((msg) => {
                     const isOwn = msg.sender_id === currentUser.id;
                     const isImage = msg.message_text.startsWith('data:image/');
@@ -804,7 +941,7 @@ export default function Index() {
                               method: 'PUT',
                               headers: {
                                 'Content-Type': 'application/json',
-                                'X-User-Id': String(currentUser.id),
+                                ...authHeaders(currentUser),
                               },
                               body: JSON.stringify({
                                 display_name: displayName,